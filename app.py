@@ -4,9 +4,13 @@ from flask_cors import CORS
 from models import db
 from routes.email import email_bp
 from routes.tracking import track_bp
+from routes.history import history_bp
+from routes.roster import roster_bp
 from dotenv import load_dotenv
 from scheduler import start_scheduler
 from utils.logger import logger
+from utils import query_stats
+from utils.db_routing import configure_binds
 import os
 
 load_dotenv()
@@ -22,11 +26,15 @@ def home():
 # Configure database connection
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DATABASE_URL")
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+configure_binds(app)
 
 # Register database and blueprint routes
 db.init_app(app)
+query_stats.init_app(app)
 app.register_blueprint(email_bp)
 app.register_blueprint(track_bp)
+app.register_blueprint(history_bp)
+app.register_blueprint(roster_bp)
 
 if __name__ == '__main__':
     logger.info("Starting mailer application")
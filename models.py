@@ -4,6 +4,25 @@ from datetime import datetime, timezone
 
 db = SQLAlchemy()
 
+
+def ensure_indexes():
+    """
+    create_all() skips indexes on tables that already exist; add any that are missing.
+    On PostgreSQL they are built CONCURRENTLY (outside a transaction) so inserts into
+    large tables keep flowing. Run once per deploy via utils/migrate.py, not at startup.
+    """
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        concurrently = conn.dialect.name == 'postgresql'
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                if concurrently:
+                    index.dialect_options['postgresql']['concurrently'] = True
+                try:
+                    index.create(bind=conn, checkfirst=True)
+                finally:
+                    if concurrently:
+                        index.dialect_options['postgresql']['concurrently'] = False
+
 class User(db.Model):
     __tablename__ = 'users'
     user_id = db.Column(db.String(100), primary_key=True)
@@ -38,12 +57,19 @@ class GroupMember(db.Model):
 
 class EmailLog(db.Model):
     __tablename__ = 'email_logs'
+    # Keyset pagination walks log_id downwards within each filter
+    __table_args__ = (
+        db.Index('ix_email_logs_sent_at', 'sent_at'),
+        db.Index('ix_email_logs_from_log', 'from_email', 'log_id'),
+        db.Index('ix_email_logs_from_status_log', 'from_email', 'status', 'log_id'),
+        db.Index('ix_email_logs_to_log', 'to_email', 'log_id'),
+    )
     log_id = db.Column(db.Integer, primary_key=True)
     from_email = db.Column(db.String(255), nullable=False)
     to_email = db.Column(db.String(255), nullable=False)
     subject = db.Column(db.String(255), nullable=False)
     body = db.Column(db.Text, nullable=False)
-    sent_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
+    sent_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     status = db.Column(db.String(50), nullable=False)
     error_message = db.Column(db.Text, nullable=True)
 
@@ -57,14 +83,14 @@ class EmailTemplate(db.Model):
 class EmailAttachment(db.Model):
     __tablename__ = 'email_attachments'
     id = db.Column(db.Integer, primary_key=True)
-    email_id = db.Column(db.Integer, db.ForeignKey('email_logs.log_id'), nullable=True)
+    email_id = db.Column(db.Integer, db.ForeignKey('email_logs.log_id'), nullable=True, index=True)
     filename = db.Column(db.String(255))
     path = db.Column(db.String(255))
 
 class EmailStatus(db.Model):
     __tablename__ = 'email_status'
     id = db.Column(db.Integer, primary_key=True)
-    email_log_id = db.Column(db.Integer, db.ForeignKey('email_logs.log_id', ondelete='CASCADE'), nullable=False)
+    email_log_id = db.Column(db.Integer, db.ForeignKey('email_logs.log_id', ondelete='CASCADE'), nullable=False, index=True)
     from_email = db.Column(db.String(255), nullable=False)
     to_email = db.Column(db.String(255), nullable=False)
     sent = db.Column(db.Boolean, default=False)
@@ -77,6 +103,9 @@ class EmailStatus(db.Model):
 
 class ScheduledEmail(db.Model):
     __tablename__ = 'scheduled_emails'
+    __table_args__ = (
+        db.Index('ix_scheduled_emails_due', 'is_sent', 'scheduled_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     from_email = db.Column(db.String(255), nullable=False)
     to_email = db.Column(db.String(255), nullable=False)
@@ -87,4 +116,53 @@ class ScheduledEmail(db.Model):
     attachments = db.Column(db.Text)  # Comma-separated
     is_sent = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    template_name = db.Column(db.String(255), nullable=True)
\ No newline at end of file
+    template_name = db.Column(db.String(255), nullable=True)
+
+class SchedulerLease(db.Model):
+    __tablename__ = 'scheduler_leases'
+    name = db.Column(db.String(100), primary_key=True)
+    holder = db.Column(db.String(255), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+
+class AdmissionBucket(db.Model):
+    # Per-user recipient quota shared by every worker (see utils/admission.py)
+    __tablename__ = 'admission_buckets'
+    user_id = db.Column(db.String(100), primary_key=True)
+    tokens = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+
+class AdmissionLock(db.Model):
+    # Row locked FOR UPDATE to serialize admission decisions across workers
+    __tablename__ = 'admission_locks'
+    name = db.Column(db.String(50), primary_key=True)
+
+
+class AdmissionJob(db.Model):
+    # One row per immediate send in progress on any worker; expires if the worker dies
+    __tablename__ = 'admission_jobs'
+    job_id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.String(100), nullable=False)
+    recipients = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class SuppressedAddress(db.Model):
+    __tablename__ = 'suppressed_addresses'
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(255), unique=True, nullable=False)
+    reason = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class RosterStaging(db.Model):
+    # Rows of an in-progress roster import; cleared when the import is applied
+    __tablename__ = 'roster_staging'
+    import_id = db.Column(db.String(32), primary_key=True)
+    group_id = db.Column(db.String(100), primary_key=True)
+    usn = db.Column(db.String(100), primary_key=True)
+    # NULL when the CSV leaves them out, so existing groups keep their name/description
+    group_name = db.Column(db.String(100))
+    group_description = db.Column(db.Text)
+    email = db.Column(db.String(255), nullable=False)
@@ -1,17 +1,17 @@
 # routes/email.py
 from flask import Blueprint, request, jsonify
-from utils.email_sender import send_bulk_emails
+from utils.email_sender import send_bulk_emails, count_recipients
+from utils.admission import admission, AdmissionRejected
+from utils.attachment_store import store_upload, resolve_attachment_id
 from utils.logger import logger
 from werkzeug.utils import secure_filename
 from datetime import datetime
 from models import ScheduledEmail,GmailAccount,User
-import os
 import json
 import pytz
 
 ALLOWED_EXTENSIONS = {'pdf', 'jpg', 'jpeg', 'png', 'docx', 'xlsx', 'txt'}
 DISALLOWED_EXTENSIONS = {'exe', 'bat', 'sh'}
-UPLOAD_FOLDER = 'attachments/'
 
 def is_file_safe(filename):
     ext = filename.rsplit('.', 1)[-1].lower()
@@ -26,27 +26,29 @@ def send_email():
         data = request.get_json()
     else:
         data = request.form.to_dict()
-    # Check for file
-    file = request.files.get('attachment')
-    filepath = None
+    # Check for files; 'attachment' may be repeated and 'attachments' is accepted too
+    files = [f for f in request.files.getlist('attachment') + request.files.getlist('attachments') if f.filename]
 
-    if file:
-        filename = secure_filename(file.filename)
+    filenames = [secure_filename(f.filename) for f in files]
+    for filename in filenames:
         logger.info(f"Attachment received: {filename}")
-        
         if not is_file_safe(filename):
             logger.warning(f"Disallowed file type rejected: {filename}")
             return jsonify({"error": "Disallowed file type"}), 400
 
-        #Make sure file is present
-        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    # Previously uploaded attachments can be reused by id ("<sha256>/<filename>") without re-uploading
+    attachment_ids_raw = data.get('attachment_ids') or []
+    try:
+        attachment_ids = json.loads(attachment_ids_raw) if isinstance(attachment_ids_raw, str) else attachment_ids_raw
+    except Exception:
+        attachment_ids = None
+    if not isinstance(attachment_ids, list) or not all(isinstance(i, str) for i in attachment_ids):
+        return jsonify({"error": "Invalid JSON in 'attachment_ids' field"}), 400
+    for attachment_id in attachment_ids:
+        if not is_file_safe(attachment_id.partition('/')[2]):
+            logger.warning(f"Disallowed file type rejected for attachment id: {attachment_id}")
+            return jsonify({"error": "Disallowed file type"}), 400
 
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        file.save(filepath)
-        logger.info(f"File saved at: {filepath}")
-    else:
-        logger.info("No attachment received with request")
-    
     # Token validation
     from_role = data.get('from_role')
     token = data.get('token')
@@ -75,6 +77,9 @@ def send_email():
     except Exception as e:
         logger.error(f"Failed to parse recipients JSON: {str(e)}")
         return jsonify({"error": "Invalid JSON in 'to' field"}), 400
+    if not isinstance(to, list) or not all(isinstance(r, str) for r in to):
+        logger.warning(f"Recipients are not a list of strings: {to!r}")
+        return jsonify({"error": "'to' must be a list of email addresses or group names"}), 400
         
     subject = data.get('subject')
     template_name = data.get('template')
@@ -105,13 +110,41 @@ def send_email():
         logger.warning(f"Missing required fields: {', '.join(missing)}")
         return jsonify({"error": f"Missing required fields: {', '.join(missing)}"}), 400
 
+    # Admission control: reject quickly rather than accept work we can't finish
+    recipient_estimate = count_recipients(to)
+    try:
+        admission_ticket = admission.admit(user.user_id, recipient_estimate, immediate=not scheduled_at)
+    except AdmissionRejected as rejection:
+        logger.warning(f"Rejected send from {user.user_id} ({recipient_estimate} recipient(s)): "
+                       f"{rejection.reason}; retry after {rejection.retry_after}s")
+        response = jsonify({"error": rejection.reason, "retry_after": rejection.retry_after})
+        response.headers['Retry-After'] = str(rejection.retry_after)
+        return response, rejection.status_code
+
     content_type="text/html"
     # Send emails
     try:
-        # Handle attachments
-        attachments = [filepath] if filepath else []
+        # Handle attachments; nothing is written to disk until the request is admitted
+        attachments = []
+        stored_attachments = []
+        for attachment_id in attachment_ids:
+            path = resolve_attachment_id(attachment_id)
+            if not path:
+                logger.warning(f"Unknown attachment id: {attachment_id}")
+                admission.refund(user.user_id, recipient_estimate)
+                return jsonify({"error": f"Unknown attachment id '{attachment_id}'"}), 400
+            attachments.append(path)
+            stored_attachments.append({"id": attachment_id, "reused": True})
+
+        for file, filename in zip(files, filenames):
+            filepath, attachment_id, size, deduplicated = store_upload(file, filename)
+            attachments.append(filepath)
+            stored_attachments.append({"id": attachment_id, "size": size, "deduplicated": deduplicated})
+
         if attachments:
             logger.info(f"Including {len(attachments)} attachment(s)")
+        else:
+            logger.info("No attachment received with request")
             
         recipient_count = len(to)
         if not scheduled_at:
@@ -122,13 +155,14 @@ def send_email():
 
             if success:
                 logger.info(f"All {recipient_count} emails sent successfully")
-                return jsonify({"message": "Emails sent successfully."}), 200
+                return jsonify({"message": "Emails sent successfully.", "attachments": stored_attachments}), 200
             else:
                 failed_count = len(failed_list)
                 logger.warning(f"{failed_count} out of {recipient_count} emails failed to send")
                 return jsonify({
                     "message": "Some emails failed to send.",
-                    "failed_recipients": failed_list
+                    "failed_recipients": failed_list,
+                    "attachments": stored_attachments
                 }), 400
         else:
             # Schedule email for later
@@ -148,8 +182,18 @@ def send_email():
                 db.session.add(scheduled)
 
             db.session.commit()
-            return jsonify({"message": "Emails scheduled successfully."}), 200
+            return jsonify({"message": "Emails scheduled successfully.", "attachments": stored_attachments}), 200
 
     except Exception as e:
         logger.error(f"Email sending crashed with error: {str(e)}", exc_info=True)
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        from models import db
+        db.session.rollback()
+        admission.refund(user.user_id, recipient_estimate)
+        return jsonify({"error": str(e)}), 500
+    finally:
+        admission.release(admission_ticket)
+
+
+@email_bp.route('/load', methods=['GET'])
+def load():
+    return jsonify(admission.snapshot()), 200
@@ -0,0 +1,82 @@
+# routes/history.py
+from flask import Blueprint, request, jsonify
+from models import EmailLog, EmailStatus, GmailAccount, User
+from utils.db_routing import read_session
+from utils.logger import logger
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+history_bp = Blueprint('history', __name__, url_prefix='/api')
+
+@history_bp.route('/delivery_history', methods=['GET'])
+def delivery_history():
+    """
+    Keyset-paginated delivery log for one sender role, newest first.
+    Pass the returned next_cursor as ?before=<cursor> to fetch the next page.
+    """
+    from_role = request.args.get('from_role')
+    token = request.args.get('token')
+    to_email = request.args.get('to')
+    status = request.args.get('status')
+
+    gmail_account = GmailAccount.query.filter_by(role=from_role).first()
+    if not gmail_account:
+        logger.warning(f"Invalid from_role for history lookup: {from_role}")
+        return jsonify({"error": f"Invalid sender role '{from_role}'"}), 400
+
+    user = User.query.filter_by(api_token=token, service_name=from_role, is_active=True).first()
+    if not user:
+        logger.warning(f"Unauthorized history lookup for role '{from_role}'")
+        return jsonify({"error": "Invalid or inactive token for the specified role"}), 401
+
+    try:
+        limit = min(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        before = int(request.args['before']) if request.args.get('before') else None
+    except ValueError:
+        return jsonify({"error": "'limit' and 'before' must be integers"}), 400
+    if limit < 1:
+        return jsonify({"error": "'limit' must be positive"}), 400
+
+    with read_session() as session:
+        query = session.query(EmailLog).filter(EmailLog.from_email == gmail_account.email)
+        if to_email:
+            query = query.filter(EmailLog.to_email == to_email)
+        if status:
+            query = query.filter(EmailLog.status == status)
+        if before is not None:
+            query = query.filter(EmailLog.log_id < before)
+
+        # Fetch one extra row to know whether another page exists
+        logs = query.order_by(EmailLog.log_id.desc()).limit(limit + 1).all()
+        has_more = len(logs) > limit
+        logs = logs[:limit]
+
+        # One lookup for the page's open tracking instead of a lazy load per row
+        statuses = {}
+        if logs:
+            rows = session.query(EmailStatus).filter(
+                EmailStatus.email_log_id.in_([log.log_id for log in logs])
+            ).all()
+            statuses = {s.email_log_id: s for s in rows}
+
+    items = []
+    for log in logs:
+        tracking = statuses.get(log.log_id)
+        items.append({
+            "log_id": log.log_id,
+            "to": log.to_email,
+            "subject": log.subject,
+            "status": log.status,
+            "sent_at": log.sent_at.isoformat() if log.sent_at else None,
+            "error_message": log.error_message,
+            "opened": bool(tracking and tracking.opened),
+            "opened_at": tracking.opened_at.isoformat() if tracking and tracking.opened_at else None,
+            "view_count": tracking.view_count if tracking else 0,
+        })
+
+    logger.info(f"Delivery history for '{from_role}': {len(items)} row(s), before={before}")
+    return jsonify({
+        "items": items,
+        "next_cursor": logs[-1].log_id if has_more else None,
+    }), 200
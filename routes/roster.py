@@ -0,0 +1,43 @@
+# routes/roster.py
+from flask import Blueprint, request, jsonify
+from models import GmailAccount, User
+from utils.roster_import import import_roster, RosterImportError
+from utils.logger import logger
+import io
+
+roster_bp = Blueprint('roster', __name__, url_prefix='/api')
+
+@roster_bp.route('/groups/import', methods=['POST'])
+def import_groups():
+    """
+    Sync group membership from an uploaded CSV roster (admin roles only).
+    mode=groups (default) only touches groups listed in the CSV;
+    mode=full also removes members of groups the CSV leaves out.
+    """
+    from_role = request.form.get('from_role')
+    token = request.form.get('token')
+    mode = request.form.get('mode') or 'groups'
+
+    gmail_account = GmailAccount.query.filter_by(role=from_role).first()
+    if not gmail_account or not gmail_account.is_admin:
+        logger.warning(f"Roster import refused for non-admin role: {from_role}")
+        return jsonify({"error": f"Role '{from_role}' may not import rosters"}), 403
+
+    user = User.query.filter_by(api_token=token, service_name=from_role, is_active=True).first()
+    if not user:
+        logger.warning(f"Unauthorized roster import attempt for role '{from_role}'")
+        return jsonify({"error": "Invalid or inactive token for the specified role"}), 401
+
+    file = request.files.get('roster')
+    if not file:
+        return jsonify({"error": "Missing 'roster' CSV file"}), 400
+
+    logger.info(f"Roster import ({mode}) requested by {user.user_id}: {file.filename}")
+    try:
+        report = import_roster(io.TextIOWrapper(file.stream, encoding='utf-8-sig', newline=''), mode)
+    except (RosterImportError, UnicodeDecodeError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Roster import failed: {e}"}), 500
+
+    return jsonify(report), 200
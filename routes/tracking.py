@@ -2,11 +2,13 @@ from flask import Blueprint, send_file, request
 from models import db, EmailStatus
 from datetime import datetime
 from utils.logger import logger
+from utils.query_stats import query_budget
 import pytz
 
 track_bp = Blueprint('track', __name__)
 
 @track_bp.route('/track/<tracking_id>.png')
+@query_budget(max_queries=1)
 def track_open(tracking_id):
     print(f"[TRACKING] Email opened with ID: {tracking_id}")
     client_ip = request.remote_addr
@@ -15,25 +17,26 @@ def track_open(tracking_id):
     logger.info(f"Tracking pixel accessed for ID: {tracking_id}")
     logger.debug(f"Request from IP: {client_ip}, User-Agent: {user_agent}")
 
-    log = EmailStatus.query.filter_by(tracking_id=tracking_id).first()
-
-    if log:
-        log.view_count = (log.view_count or 0) + 1
-
-        if not log.opened and log.view_count >= 1:
-            ist = pytz.timezone('Asia/Kolkata')
-            log.opened = True
-            log.opened_at = datetime.now(ist)
-            logger.info(f"Confirmed real open (2nd+ view) for email from {log.from_email} to {log.to_email}")
-
-        try:
-            db.session.commit()
+    # One atomic UPDATE on the primary: no read round trip, and concurrent
+    # opens can't lose increments
+    ist = pytz.timezone('Asia/Kolkata')
+    try:
+        updated = EmailStatus.query.filter_by(tracking_id=tracking_id).update({
+            EmailStatus.view_count: db.func.coalesce(EmailStatus.view_count, 0) + 1,
+            EmailStatus.opened: True,
+            EmailStatus.opened_at: db.case(
+                (EmailStatus.opened_at.is_(None), datetime.now(ist)),
+                else_=EmailStatus.opened_at
+            ),
+        }, synchronize_session=False)
+        db.session.commit()
+        if updated:
             logger.debug(f"Email status updated for tracking ID: {tracking_id}")
-        except Exception as e:
-            db.session.rollback()
-            logger.error(f"Failed to update email tracking status: {str(e)}", exc_info=True)
-    else:
-        logger.warning(f"No email record found for tracking ID: {tracking_id}")
+        else:
+            logger.warning(f"No email record found for tracking ID: {tracking_id}")
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Failed to update email tracking status: {str(e)}", exc_info=True)
 
     response = send_file('tracking_pixels/pixel.png', mimetype='image/png')
     response.headers['Access-Control-Allow-Origin'] = '*'
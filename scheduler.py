@@ -1,43 +1,99 @@
 # scheduler.py
 from apscheduler.schedulers.background import BackgroundScheduler
-from datetime import datetime 
+from datetime import datetime
 from models import ScheduledEmail, db
 from utils.email_sender import send_bulk_emails
+from utils.leader import LeaderLease, LEASE_RENEW_SECONDS
+from utils.log_archive import archive_old_logs
+from utils.attachment_store import collect_garbage, touch_attachments
+from utils.db_routing import read_session
+from utils.variable_resolver import BULK_LOOKUP_CHUNK
 import pytz
 from utils.logger import logger
 
-def send_scheduled_emails(app):
+def send_scheduled_emails(app, lease=None):
+    # Every worker runs this job; only the current lease holder sends
+    if lease is not None and not lease.is_leader():
+        return
+
     with app.app_context():
         ist = pytz.timezone('Asia/Kolkata')
         now = datetime.now(ist)
-        pending_emails = ScheduledEmail.query.filter(
-            ScheduledEmail.scheduled_at <= now,
-            ScheduledEmail.is_sent == False
-        ).all()
+        # Scan for due jobs on the replica, then re-read just those rows on the
+        # primary so replica lag can never resend an email already marked sent
+        with read_session() as session:
+            due_ids = [row.id for row in session.query(ScheduledEmail.id).filter(
+                ScheduledEmail.scheduled_at <= now,
+                ScheduledEmail.is_sent == False
+            ).order_by(ScheduledEmail.id)]
+
+        pending_emails = []
+        for start in range(0, len(due_ids), BULK_LOOKUP_CHUNK):
+            pending_emails.extend(ScheduledEmail.query.filter(
+                ScheduledEmail.id.in_(due_ids[start:start + BULK_LOOKUP_CHUNK]),
+                ScheduledEmail.is_sent == False
+            ).order_by(ScheduledEmail.id).all())
 
         if pending_emails:
             logger.info(f"Processing {len(pending_emails)} scheduled emails")
-            
+
         for email in pending_emails:
+            if lease is not None and not lease.is_leader():
+                logger.warning("Scheduler lease lost mid-run; leaving remaining emails to the new leader")
+                break
+
+            # Claim the row atomically before sending. Only one process can flip
+            # is_sent, so a leader that loses its lease mid-send can't race the
+            # new leader into sending the same row twice.
+            claimed = ScheduledEmail.query.filter(
+                ScheduledEmail.id == email.id,
+                ScheduledEmail.is_sent == False
+            ).update({"is_sent": True}, synchronize_session=False)
+            db.session.commit()
+            if not claimed:
+                logger.info(f"Scheduled email {email.id} already claimed by another scheduler; skipping")
+                continue
+
             print(f"Sending scheduled email to {email.to_email}")
-            success, failed_list = send_bulk_emails(
-                from_role=email.from_email,
-                to_list=email.to_email.split(','),
-                subject=email.subject,
-                body=email.body,
-                content_type=email.content_type,
-                attachments=email.attachments.split(',') if email.attachments else [],
-                template_name=email.template_name
-            )
-            
-            if success:
-                email.is_sent = True
-                db.session.commit()
-            else:
+            attachments = email.attachments.split(',') if email.attachments else []
+            # Claimed rows no longer count as pending for attachment GC
+            touch_attachments(attachments)
+            try:
+                success, failed_list = send_bulk_emails(
+                    from_role=email.from_email,
+                    to_list=email.to_email.split(','),
+                    subject=email.subject,
+                    body=email.body,
+                    content_type=email.content_type,
+                    attachments=attachments,
+                    template_name=email.template_name
+                )
+            except Exception as e:
+                logger.error(f"Scheduled email {email.id} crashed while sending: {e}", exc_info=True)
+                success, failed_list = False, [email.to_email]
+
+            if not success:
                 logger.warning(f"Failed to send scheduled email to: {', '.join(failed_list)}")
+                # Release the claim so the next run retries it
+                try:
+                    db.session.rollback()
+                    ScheduledEmail.query.filter_by(id=email.id).update({"is_sent": False}, synchronize_session=False)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Failed to release claim on scheduled email {email.id}: {e}")
 
 def start_scheduler(app):
         logger.info("Starting email scheduler")
+        lease = LeaderLease(app)
+        lease.renew()
+        lease.register_release_at_exit()
+
         scheduler = BackgroundScheduler()
-        scheduler.add_job(send_scheduled_emails, 'interval', seconds=30, args=[app])
-        scheduler.start()
\ No newline at end of file
+        scheduler.add_job(lease.renew, 'interval', seconds=LEASE_RENEW_SECONDS)
+        scheduler.add_job(send_scheduled_emails, 'interval', seconds=30, args=[app, lease])
+        scheduler.add_job(archive_old_logs, 'cron', hour=3, args=[app, lease])
+        # Blob GC only touches files, so it isn't gated on the lease
+        scheduler.add_job(collect_garbage, 'interval', hours=1, args=[app])
+        scheduler.start()
+        return scheduler
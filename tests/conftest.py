@@ -0,0 +1,26 @@
+# tests/conftest.py
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app.py reads DATABASE_URL at import time; load_dotenv() won't override it
+_DB_DIR = tempfile.mkdtemp(prefix="mailer-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_DB_DIR, 'test.db')}"
+os.environ.pop("DATABASE_REPLICA_URL", None)
+os.environ["TRACE_DIR"] = os.path.join(_DB_DIR, "traces")
+
+
+@pytest.fixture
+def app():
+    from app import app as flask_app
+    from models import db
+
+    with flask_app.app_context():
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
@@ -0,0 +1,101 @@
+# tests/test_query_budgets.py
+# Hot paths declare a query_budget; these run them against SQLite in strict
+# mode so a regression to per-row lookups fails here rather than in production.
+import pytest
+
+from models import db, EmailLog, EmailStatus, EmailTemplate, GmailAccount, Group, GroupMember
+import utils.email_sender as email_sender
+from utils.email_sender import fetch_sender_credentials, resolve_recipients, send_bulk_emails
+from utils.query_stats import query_budget, QueryBudgetExceeded
+from utils.template_loader import load_template_source
+from utils.variable_resolver import fetch_template_variables
+
+USNS = [f"1XX{n:03d}" for n in range(25)]
+
+
+@pytest.fixture
+def roster(app):
+    db.session.add_all([
+        Group(group_id="g1", name="puc1", description="First year"),
+        Group(group_id="g2", name="puc2", description="Second year"),
+        GmailAccount(role="office", email="office@example.com", token="secret"),
+    ])
+    db.session.add_all(
+        GroupMember(group_id="g1" if n % 2 else "g2", usn=usn, email=f"{usn.lower()}@example.com")
+        for n, usn in enumerate(USNS)
+    )
+    db.session.commit()
+
+
+def test_resolve_recipients_batches_usn_lookups(roster):
+    with query_budget(max_queries=3, max_repeats=1, strict=True):
+        resolved = resolve_recipients(USNS + ["puc1*", "someone@example.com"])
+    assert set(USNS) <= set(resolved)
+    assert "someone@example.com" in resolved
+
+
+def test_fetch_template_variables(roster):
+    with query_budget(max_queries=2, strict=True):
+        variables, error = fetch_template_variables(USNS[0])
+    assert error is None
+    assert variables["class_name"] == "puc2"
+
+
+def test_load_template_source(app, tmp_path):
+    template_file = tmp_path / "welcome.html"
+    template_file.write_text("<p>Hello {{ usn }}</p>", encoding="utf-8")
+    db.session.add(EmailTemplate(name="welcome", file_path=str(template_file)))
+    db.session.commit()
+
+    with query_budget(max_queries=1, strict=True):
+        assert "Hello" in load_template_source("welcome")
+
+
+def test_fetch_sender_credentials(roster):
+    with query_budget(max_queries=1, strict=True):
+        assert fetch_sender_credentials("office") == ("office@example.com", "secret")
+
+
+def test_track_open_is_one_update(app):
+    log = EmailLog(from_email="office@example.com", to_email="a@example.com",
+                   subject="Hi", body="Hi", status="sent")
+    db.session.add(log)
+    db.session.flush()
+    db.session.add(EmailStatus(email_log_id=log.log_id, from_email=log.from_email,
+                               to_email=log.to_email, tracking_id="abc123"))
+    db.session.commit()
+
+    client = app.test_client()
+    with query_budget(max_queries=1, strict=True):
+        response = client.get("/track/abc123.png")
+    assert response.status_code == 200
+
+    db.session.expire_all()
+    assert db.session.get(EmailStatus, 1).view_count == 1
+
+
+def test_per_usn_lookups_exceed_budget(roster):
+    # The pre-batching shape: one member lookup (plus group lookup) per USN
+    with pytest.raises(QueryBudgetExceeded):
+        with query_budget(max_repeats=10, strict=True):
+            for usn in USNS:
+                fetch_template_variables(usn)
+
+
+@pytest.mark.parametrize("template", [None, "welcome"])
+def test_send_bulk_emails_batches_usn_lookups(roster, tmp_path, monkeypatch, template):
+    # Stub SMTP (and its per-message log writes) so only lookup queries are counted
+    sent = []
+    monkeypatch.setattr(email_sender, "send_email_smtp",
+                        lambda from_email, token, to_email, *args: sent.append(to_email) or (True, to_email))
+    if template:
+        template_file = tmp_path / "welcome.html"
+        template_file.write_text("<p>Hello {{ usn }}</p>", encoding="utf-8")
+        db.session.add(EmailTemplate(name=template, file_path=str(template_file)))
+        db.session.commit()
+
+    with query_budget(max_repeats=len(USNS) // 2, strict=True):
+        success, failed = send_bulk_emails("office", USNS, "Hi", "Hello", template_name=template)
+
+    assert success and not failed
+    assert sorted(sent) == sorted(f"{usn.lower()}@example.com" for usn in USNS)
@@ -0,0 +1,215 @@
+# utils/admission.py
+# Admission control for /api/send_email: refuse work up front instead of
+# starting more sender threads and SMTP connections than we can carry.
+# Job slots and per-user quotas live in the database, so the limits hold
+# across all gunicorn workers and nodes rather than per process.
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from threading import Lock
+from models import db, AdmissionBucket, AdmissionJob, AdmissionLock
+from utils.logger import logger
+import math
+import os
+import uuid
+
+# Recipients being sent right now across all immediate jobs
+MAX_INFLIGHT_RECIPIENTS = int(os.getenv("MAX_INFLIGHT_RECIPIENTS", 20000))
+# Concurrent immediate jobs; each runs up to SENDER_THREADS sender threads
+MAX_ACTIVE_JOBS = int(os.getenv("MAX_ACTIVE_JOBS", 8))
+# Per-user quota: sustained recipients per minute, and the burst allowed on top
+USER_RECIPIENTS_PER_MINUTE = float(os.getenv("USER_RECIPIENTS_PER_MINUTE", 2000))
+USER_RECIPIENT_BURST = float(os.getenv("USER_RECIPIENT_BURST", 20000))
+# Retry-After hint when the service itself is saturated
+OVERLOAD_RETRY_AFTER = int(os.getenv("OVERLOAD_RETRY_AFTER", 30))
+# A job slot held longer than this is assumed lost (worker killed mid-send) and freed
+ADMISSION_JOB_TTL_SECONDS = int(os.getenv("ADMISSION_JOB_TTL_SECONDS", 3600))
+
+# admission_locks row taken FOR UPDATE around every admission decision
+_ADMISSION_LOCK_NAME = "admission"
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code, retry_after, reason):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class TokenBucket:
+    """Token bucket over a stored (tokens, updated_at) pair."""
+
+    def __init__(self, rate_per_second, burst, tokens=None, updated=None):
+        self.rate = rate_per_second
+        self.burst = burst
+        self.tokens = burst if tokens is None else tokens
+        self.updated = updated or _utcnow()
+
+    def _refill(self, now):
+        elapsed = max(0.0, (now - self.updated).total_seconds())
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    def take(self, amount, now):
+        """Take amount tokens, or return the seconds until that becomes possible."""
+        self._refill(now)
+        # A full bucket admits any single request; oversize sends go into debt
+        if self.tokens >= amount or self.tokens >= self.burst:
+            self.tokens -= amount
+            return 0
+        needed = min(amount, self.burst) - self.tokens
+        return math.ceil(needed / self.rate) if self.rate > 0 else OVERLOAD_RETRY_AFTER
+
+    def available(self, now):
+        self._refill(now)
+        return self.tokens
+
+
+def _new_bucket(tokens=None, updated=None):
+    return TokenBucket(USER_RECIPIENTS_PER_MINUTE / 60.0, USER_RECIPIENT_BURST, tokens, updated)
+
+
+class AdmissionController:
+    """
+    Shared admission state in admission_jobs / admission_buckets. Each decision
+    runs in one short transaction holding a lock row (SELECT ... FOR UPDATE on
+    PostgreSQL and MySQL; SQLite's database write lock otherwise), so concurrent
+    workers can't both take the last slot. Must run inside an app context.
+    """
+
+    def __init__(self):
+        # Rejections are only counted per worker, for the /api/load breakdown
+        self._lock = Lock()
+        self._rejected = {"quota": 0, "overload": 0}
+
+    def _reject(self, kind, status_code, retry_after, reason):
+        with self._lock:
+            self._rejected[kind] += 1
+        raise AdmissionRejected(status_code, retry_after, reason)
+
+    def _lock_admission(self, now):
+        expired = AdmissionJob.query.filter(AdmissionJob.expires_at < now)
+        if db.session.get_bind().dialect.name == 'sqlite':
+            # SQLite ignores FOR UPDATE; the first write takes its database lock instead
+            expired.delete(synchronize_session=False)
+            return
+
+        lock_query = AdmissionLock.query.filter_by(name=_ADMISSION_LOCK_NAME).with_for_update()
+        if lock_query.one_or_none() is None:
+            try:
+                db.session.add(AdmissionLock(name=_ADMISSION_LOCK_NAME))
+                db.session.flush()
+            except IntegrityError:
+                # Another worker created the row first; wait on its lock instead
+                db.session.rollback()
+                lock_query.one()
+        expired.delete(synchronize_session=False)
+
+    def _bucket_row(self, user_id, now):
+        row = db.session.get(AdmissionBucket, user_id)
+        bucket = _new_bucket(row.tokens, row.updated_at) if row else _new_bucket()
+        bucket.available(now)
+        return row, bucket
+
+    def _save_bucket(self, row, user_id, bucket):
+        if row is None:
+            row = AdmissionBucket(user_id=user_id)
+            db.session.add(row)
+        row.tokens, row.updated_at = bucket.tokens, bucket.updated
+
+    def admit(self, user_id, recipients, immediate=True):
+        """
+        Reserve capacity for a request, or raise AdmissionRejected.
+        Immediate sends also hold a job slot until release(ticket); returns the
+        ticket, or None for scheduled sends.
+        """
+        now = _utcnow()
+        try:
+            self._lock_admission(now)
+            if immediate:
+                active_jobs, inflight = db.session.query(
+                    func.count(AdmissionJob.job_id), func.coalesce(func.sum(AdmissionJob.recipients), 0)
+                ).one()
+                if active_jobs >= MAX_ACTIVE_JOBS:
+                    db.session.rollback()
+                    self._reject("overload", 503, OVERLOAD_RETRY_AFTER,
+                                 f"Sender pool busy ({active_jobs} active jobs)")
+                # An idle service always takes one job, however large
+                if inflight and inflight + recipients > MAX_INFLIGHT_RECIPIENTS:
+                    db.session.rollback()
+                    self._reject("overload", 503, OVERLOAD_RETRY_AFTER,
+                                 f"Too many recipients in flight ({inflight})")
+
+            row, bucket = self._bucket_row(user_id, now)
+            retry_after = bucket.take(recipients, now)
+            if retry_after:
+                db.session.rollback()
+                self._reject("quota", 429, retry_after, "Recipient quota exceeded for this token")
+            self._save_bucket(row, user_id, bucket)
+
+            ticket = None
+            if immediate:
+                ticket = uuid.uuid4().hex
+                db.session.add(AdmissionJob(
+                    job_id=ticket, user_id=user_id, recipients=recipients,
+                    expires_at=now + timedelta(seconds=ADMISSION_JOB_TTL_SECONDS)
+                ))
+            db.session.commit()
+            return ticket
+        except AdmissionRejected:
+            raise
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Admission check failed: {e}")
+            raise AdmissionRejected(503, OVERLOAD_RETRY_AFTER, "Admission control unavailable")
+
+    def refund(self, user_id, recipients):
+        """Return quota taken by admit() for a request that failed before sending."""
+        now = _utcnow()
+        try:
+            self._lock_admission(now)
+            row, bucket = self._bucket_row(user_id, now)
+            bucket.tokens = min(bucket.burst, bucket.tokens + recipients)
+            self._save_bucket(row, user_id, bucket)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Failed to refund {recipients} recipient(s) of quota to {user_id}: {e}")
+
+    def release(self, ticket):
+        if ticket is None:
+            return
+        try:
+            AdmissionJob.query.filter_by(job_id=ticket).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            # The slot frees itself after ADMISSION_JOB_TTL_SECONDS
+            db.session.rollback()
+            logger.error(f"Failed to release admission slot {ticket}: {e}")
+
+    def snapshot(self):
+        now = _utcnow()
+        active_jobs, inflight = db.session.query(
+            func.count(AdmissionJob.job_id), func.coalesce(func.sum(AdmissionJob.recipients), 0)
+        ).filter(AdmissionJob.expires_at >= now).one()
+        # Only drained buckets can still be below one token after refilling
+        low = AdmissionBucket.query.filter(AdmissionBucket.tokens < 1).all()
+        throttled = sum(1 for row in low if _new_bucket(row.tokens, row.updated_at).available(now) < 1)
+        with self._lock:
+            rejected = dict(self._rejected)
+        return {
+            "inflight_recipients": int(inflight),
+            "max_inflight_recipients": MAX_INFLIGHT_RECIPIENTS,
+            "active_jobs": active_jobs,
+            "max_active_jobs": MAX_ACTIVE_JOBS,
+            "throttled_users": throttled,
+            "worker": {"pid": os.getpid(), "rejected": rejected},
+        }
+
+
+admission = AdmissionController()
@@ -0,0 +1,185 @@
+# utils/attachment_store.py
+# Content-addressed attachment storage.
+#
+#   attachments/blobs/<sha256>              one copy of each distinct file
+#   attachments/files/<sha256>/<filename>   hard link to the blob under its upload name
+#
+# Senders keep using plain paths (basename = attachment filename), identical
+# uploads share one blob, and same-named uploads with different content no
+# longer overwrite each other. The id "<sha256>/<filename>" lets a client
+# reuse an upload in later requests without sending the file again.
+#
+# With more than one node, ATTACHMENT_ROOT must be shared storage (NFS, EFS,
+# ...) mounted at the same path everywhere: the scheduler leader sends mail
+# uploaded through other nodes, and attachment ids are reused on any node.
+# A recipient whose attachment is missing is failed, never sent without it.
+from werkzeug.utils import secure_filename
+from models import ScheduledEmail
+from utils.logger import logger
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import time
+
+ATTACHMENT_ROOT = os.getenv("ATTACHMENT_ROOT", "attachments")
+BLOB_DIR = os.path.join(ATTACHMENT_ROOT, "blobs")
+FILES_DIR = os.path.join(ATTACHMENT_ROOT, "files")
+TMP_DIR = os.path.join(ATTACHMENT_ROOT, "tmp")
+CHUNK_SIZE = 1024 * 1024
+# Unreferenced blobs younger than this are kept, covering immediate sends still in progress
+ATTACHMENT_GC_GRACE_SECONDS = int(os.getenv("ATTACHMENT_GC_GRACE_SECONDS", 24 * 3600))
+
+_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+
+
+def _ensure_dirs():
+    for path in (BLOB_DIR, FILES_DIR, TMP_DIR):
+        os.makedirs(path, exist_ok=True)
+
+
+def _named_path(digest, filename):
+    return os.path.join(FILES_DIR, digest, filename)
+
+
+def _link_named(digest, filename):
+    named = _named_path(digest, filename)
+    if not os.path.exists(named):
+        os.makedirs(os.path.dirname(named), exist_ok=True)
+        try:
+            os.link(os.path.join(BLOB_DIR, digest), named)
+        except FileExistsError:
+            pass
+        except OSError:
+            # Filesystems without hard links get a copy instead
+            shutil.copyfile(os.path.join(BLOB_DIR, digest), named)
+    return named
+
+
+def store_upload(file_storage, filename):
+    """
+    Stream an uploaded file to disk while hashing it and return
+    (path, attachment_id, size, deduplicated).
+    """
+    _ensure_dirs()
+    hasher = hashlib.sha256()
+    size = 0
+
+    fd, tmp_path = tempfile.mkstemp(dir=TMP_DIR)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = file_storage.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+
+        digest = hasher.hexdigest()
+        blob = os.path.join(BLOB_DIR, digest)
+        deduplicated = os.path.exists(blob)
+        if deduplicated:
+            os.remove(tmp_path)
+            # Refresh the blob's age so GC treats it as recently used
+            os.utime(blob)
+        else:
+            os.replace(tmp_path, blob)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    path = _named_path(digest, filename)
+    _link_named(digest, filename)
+    logger.info(f"Stored attachment {filename} ({size} bytes, sha256 {digest[:12]}..."
+                f"{', deduplicated' if deduplicated else ''})")
+    return path, f"{digest}/{filename}", size, deduplicated
+
+
+def resolve_attachment_id(attachment_id):
+    """Map a '<sha256>/<filename>' id from an earlier upload to its path, or None."""
+    digest, _, filename = (attachment_id or "").partition("/")
+    if not _SHA256.match(digest) or not filename or secure_filename(filename) != filename:
+        return None
+    if not os.path.exists(os.path.join(BLOB_DIR, digest)):
+        return None
+    os.utime(os.path.join(BLOB_DIR, digest))
+    return _link_named(digest, filename)
+
+
+def _digest_from_path(path):
+    parts = os.path.normpath(path).split(os.sep)
+    return parts[-2] if len(parts) >= 2 and _SHA256.match(parts[-2]) else None
+
+
+def touch_attachments(paths):
+    """
+    Refresh the age of the blobs behind these paths. The scheduler calls this when
+    it claims a row (is_sent=True), so GC keeps them for the grace period while sending.
+    """
+    for path in paths:
+        digest = _digest_from_path(path)
+        if not digest:
+            continue
+        try:
+            os.utime(os.path.join(BLOB_DIR, digest))
+        except FileNotFoundError:
+            logger.warning(f"Attachment blob missing for {path}")
+
+
+def collect_garbage(app):
+    """
+    Delete blobs no pending scheduled email references once they're past the grace period.
+    Rows being sent are already claimed (is_sent=True), so they're covered by the
+    grace period instead: touch_attachments() refreshes their blobs at claim time.
+    Safe to run from every worker against the shared ATTACHMENT_ROOT; concurrent runs
+    skip files another run already removed.
+    """
+    if not os.path.isdir(BLOB_DIR):
+        return 0
+
+    with app.app_context():
+        referenced = set()
+        pending = ScheduledEmail.query.with_entities(ScheduledEmail.attachments).filter(
+            ScheduledEmail.is_sent == False,
+            ScheduledEmail.attachments.isnot(None)
+        ).yield_per(1000)
+        for (attachments,) in pending:
+            for path in attachments.split(','):
+                digest = _digest_from_path(path)
+                if digest:
+                    referenced.add(digest)
+
+    cutoff = time.time() - ATTACHMENT_GC_GRACE_SECONDS
+    removed = 0
+    freed = 0
+    for digest in os.listdir(BLOB_DIR):
+        blob = os.path.join(BLOB_DIR, digest)
+        try:
+            if digest in referenced or os.path.getmtime(blob) > cutoff:
+                continue
+            size = os.path.getsize(blob)
+            shutil.rmtree(os.path.join(FILES_DIR, digest), ignore_errors=True)
+            os.remove(blob)
+        except FileNotFoundError:
+            # Another worker on this node collected it first
+            continue
+        freed += size
+        removed += 1
+
+    # Leftovers from interrupted uploads
+    if os.path.isdir(TMP_DIR):
+        for name in os.listdir(TMP_DIR):
+            tmp = os.path.join(TMP_DIR, name)
+            try:
+                if os.path.getmtime(tmp) < cutoff:
+                    os.remove(tmp)
+            except FileNotFoundError:
+                continue
+
+    if removed:
+        logger.info(f"Attachment GC removed {removed} blob(s), freed {freed} bytes "
+                    f"({len(referenced)} still referenced)")
+    return removed
@@ -0,0 +1,109 @@
+# utils/db_routing.py
+# Route read-only traffic (reporting, status lookups, due-job scans) to a
+# replica engine with its own connection pool. Writes always use db.session.
+# Falls back to the primary when no replica is configured, when it can't be
+# reached, or when it lags more than REPLICA_MAX_LAG_SECONDS.
+from contextlib import contextmanager
+from threading import Lock
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+from models import db
+from utils.logger import logger
+import os
+import time
+
+REPLICA_BIND = 'replica'
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+REPLICA_POOL_SIZE = os.getenv("REPLICA_POOL_SIZE")
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", 5))
+# How long a lag measurement is trusted before the replica is probed again
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv("REPLICA_LAG_CHECK_SECONDS", 10))
+# Keep a dead replica from stalling requests: connect and pool checkout limits
+REPLICA_CONNECT_TIMEOUT = int(os.getenv("REPLICA_CONNECT_TIMEOUT", 3))
+REPLICA_POOL_TIMEOUT = float(os.getenv("REPLICA_POOL_TIMEOUT", 5))
+
+# Zero when the replica has replayed everything it received, so an idle
+# primary doesn't look like lag; NULL (treated as 0) on a non-replica server.
+_PG_LAG_SQL = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+_health_lock = Lock()
+_healthy = False
+_checked_at = 0.0
+_probing = False
+
+
+def configure_binds(app):
+    """Register the replica bind; call before db.init_app(app)."""
+    if not DATABASE_REPLICA_URL:
+        return
+    bind = {"url": DATABASE_REPLICA_URL, "pool_timeout": REPLICA_POOL_TIMEOUT}
+    backend = make_url(DATABASE_REPLICA_URL).get_backend_name()
+    if backend == 'postgresql':
+        bind["connect_args"] = {"connect_timeout": REPLICA_CONNECT_TIMEOUT}
+    elif backend == 'mysql':
+        bind["connect_args"] = {"connection_timeout": REPLICA_CONNECT_TIMEOUT}
+    if REPLICA_POOL_SIZE:
+        bind["pool_size"] = int(REPLICA_POOL_SIZE)
+    app.config.setdefault('SQLALCHEMY_BINDS', {})[REPLICA_BIND] = bind
+    logger.info("Read replica configured for reporting, tracking and scheduler scans")
+
+
+def _measure_lag(engine):
+    if engine.dialect.name != 'postgresql':
+        return 0.0
+    with engine.connect() as conn:
+        lag = conn.execute(_PG_LAG_SQL).scalar()
+    return float(lag or 0)
+
+
+def replica_available():
+    """
+    Cached check that the replica is reachable and within the lag limit.
+    One thread probes at a time, outside the lock; others use the cached result.
+    """
+    global _healthy, _checked_at, _probing
+    if REPLICA_BIND not in db.engines:
+        return False
+
+    with _health_lock:
+        if _probing or time.monotonic() - _checked_at < REPLICA_LAG_CHECK_SECONDS:
+            return _healthy
+        _probing = True
+
+    healthy = False
+    try:
+        lag = _measure_lag(db.engines[REPLICA_BIND])
+        healthy = lag <= REPLICA_MAX_LAG_SECONDS
+        if not healthy:
+            logger.warning(f"Replica lag {lag:.1f}s exceeds {REPLICA_MAX_LAG_SECONDS}s; reading from primary")
+    except Exception as e:
+        logger.warning(f"Replica unavailable, reading from primary: {e}")
+    finally:
+        with _health_lock:
+            if healthy and not _healthy:
+                logger.info("Routing reads to replica")
+            _healthy = healthy
+            _checked_at = time.monotonic()
+            _probing = False
+    return healthy
+
+
+@contextmanager
+def read_session():
+    """
+    Session for read-only queries. Use session.query(Model) rather than
+    Model.query inside the block; never write through it.
+    """
+    if not replica_available():
+        yield db.session
+        return
+
+    session = Session(bind=db.engines[REPLICA_BIND])
+    try:
+        yield session
+    finally:
+        session.close()
@@ -4,16 +4,26 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.application import MIMEApplication
 from threading import Thread, Lock
+from queue import Queue, Empty
 from email.utils import make_msgid
 import time
 import re
 import os
 import uuid
 import traceback
-from models import GmailAccount, Group, GroupMember, EmailLog, EmailStatus
+from models import db, GmailAccount, Group, GroupMember, EmailLog, EmailStatus
 from utils.logger import logger
-from utils.template_loader import load_and_render_template
-from utils.variable_resolver import fetch_template_variables
+from utils.template_loader import load_template, load_template_source
+from utils.variable_resolver import fetch_template_variables_bulk, BULK_LOOKUP_CHUNK
+from utils.render_pool import render_to_queue, RENDER_POOL_MIN_RECIPIENTS
+from utils.tracing import start_job_trace, NULL_TRACE
+from utils.suppression import suppression_list
+from utils.query_stats import query_budget, collect_queries, current_collectors, attach
+
+# Sender threads per bulk job
+SENDER_THREADS = int(os.getenv("SENDER_THREADS", 50))
+# Rendered messages buffered between the render stage and the senders
+RENDER_QUEUE_SIZE = int(os.getenv("RENDER_QUEUE_SIZE", 1000))
 
 
 def is_valid_email(email):
@@ -24,6 +34,7 @@ def is_valid_email(email):
     return result
 
 
+@query_budget(max_queries=1)
 def fetch_sender_credentials(role):
     logger.debug(f"Fetching sender credentials for role: {role}")
     sender = GmailAccount.query.filter_by(role=role).first()
@@ -34,11 +45,14 @@ def fetch_sender_credentials(role):
     return None, None
 
 
+# One query per group/broadcast item; USNs are looked up in batches
+@query_budget(max_repeats=10)
 def resolve_recipients(to_list):
     logger.info(f"Resolving {len(to_list)} recipient identifiers")
     logger.debug(f"Raw to_list input: {to_list}")
     
     result = set()
+    usn_items = []
     groups_resolved = 0
     users_resolved = 0
     not_found = 0
@@ -75,12 +89,19 @@ def resolve_recipients(to_list):
             result.add(item)
             logger.debug(f"Added direct email: {item}")
 
-        else:  # Unicast USN
-            member = GroupMember.query.filter_by(usn=item).first()
-            if member:
+        else:  # Unicast USN, looked up in batches below
+            usn_items.append(item)
+
+    for start in range(0, len(usn_items), BULK_LOOKUP_CHUNK):
+        chunk = usn_items[start:start + BULK_LOOKUP_CHUNK]
+        found = dict(
+            db.session.query(GroupMember.usn, GroupMember.email).filter(GroupMember.usn.in_(chunk)).all()
+        )
+        for item in chunk:
+            if item in found:
                 result.add(item)
                 users_resolved += 1
-                logger.info(f"Resolved USN '{item}' to {member.email}")
+                logger.info(f"Resolved USN '{item}' to {found[item]}")
             else:
                 not_found += 1
                 logger.warning(f"USN '{item}' not found")
@@ -91,6 +112,22 @@ def resolve_recipients(to_list):
     return resolved
 
 
+def count_recipients(to_list):
+    """Cheap upper bound on how many recipients to_list resolves to, using COUNT queries."""
+    total = 0
+    for item in to_list:
+        item = item.strip()
+        if item == "*":
+            total += GroupMember.query.count()
+        elif item.endswith("*"):
+            total += GroupMember.query.join(Group, Group.group_id == GroupMember.group_id).filter(
+                Group.name == item[:-1]
+            ).count()
+        else:
+            total += 1
+    return total
+
+
 def generate_tracking_pixel(tracking_id, base_url=None):
     """Generate tracking pixel HTML with configurable base URL"""
     if base_url is None:
@@ -101,7 +138,7 @@ def generate_tracking_pixel(tracking_id, base_url=None):
     return f'<img src="{tracking_url}" width="1" height="1" style="display:none;" alt=""/>'
 
 
-def send_email_smtp(from_email, from_token, to_email, subject, body, content_type="text/html", attachments=[]):
+def send_email_smtp(from_email, from_token, to_email, subject, body, content_type="text/html", attachments=[], trace=NULL_TRACE):
     from models import db
     from app import app
     
@@ -113,6 +150,13 @@ def send_email_smtp(from_email, from_token, to_email, subject, body, content_typ
     attempt = 0
     error_message = ""
     tracking_id = uuid.uuid4().hex
+
+    # An attachment can vanish mid-job (GC, unshared storage); fail rather than send without it
+    missing = [path for path in attachments if not os.path.exists(path)]
+    if missing:
+        error_message = f"Attachment file not found: {', '.join(missing)}"
+        logger.error(f"Not sending to {to_email}: {error_message}")
+        attempt = max_attempts  # Skip the send loop; logged as failed below
     
     # Only add tracking pixel for HTML emails
     if content_type.lower() == "text/html":
@@ -124,9 +168,12 @@ def send_email_smtp(from_email, from_token, to_email, subject, body, content_typ
     while attempt < max_attempts:
         attempt += 1
         try:
+            connect_start = time.perf_counter()
             with smtplib.SMTP('smtp.gmail.com', 587) as smtp:
                 smtp.starttls()
-                smtp.login(from_email, from_token)
+                trace.record("smtp_connect", connect_start, time.perf_counter(), to_email)
+                with trace.span("smtp_login", to_email):
+                    smtp.login(from_email, from_token)
 
                 msg = MIMEMultipart('alternative')
                 msg['Subject'] = subject
@@ -140,32 +187,26 @@ def send_email_smtp(from_email, from_token, to_email, subject, body, content_typ
                 else:
                     msg.attach(MIMEText(email_body, 'plain'))
 
-                # Handle attachments with better error handling
+                # Unreadable attachments raise and fail this attempt, like any other error
                 for path in attachments:
-                    try:
-                        if not os.path.exists(path):
-                            logger.warning(f"Attachment file not found: {path}")
-                            continue
-                            
-                        filename = os.path.basename(path)
-                        with open(path, 'rb') as f:
-                            file_data = f.read()
-                            if len(file_data) == 0:
-                                logger.warning(f"Attachment file is empty: {path}")
-                                continue
-                                
-                            part = MIMEApplication(file_data)
-                            part.add_header('Content-Disposition', 'attachment', filename=filename)
-                            msg.attach(part)
-                            logger.debug(f"Attached file: {filename} ({len(file_data)} bytes)")
-                    except Exception as e:
-                        logger.warning(f"Failed to attach file {path}: {e}")
+                    filename = os.path.basename(path)
+                    with open(path, 'rb') as f:
+                        file_data = f.read()
+                    if len(file_data) == 0:
+                        logger.warning(f"Attachment file is empty: {path}")
+                        continue
+
+                    part = MIMEApplication(file_data)
+                    part.add_header('Content-Disposition', 'attachment', filename=filename)
+                    msg.attach(part)
+                    logger.debug(f"Attached file: {filename} ({len(file_data)} bytes)")
 
                 # Send the email
-                smtp.send_message(msg)
+                with trace.span("smtp_data", to_email):
+                    smtp.send_message(msg)
 
             # Log success in app context
-            with app.app_context():
+            with app.app_context(), trace.span("db_log", to_email):
                 try:
                     log = EmailLog(
                         from_email=from_email, 
@@ -202,21 +243,27 @@ def send_email_smtp(from_email, from_token, to_email, subject, body, content_typ
         except smtplib.SMTPRecipientsRefused as e:
             error_message = f"Recipient refused: {str(e)}"
             logger.error(f"Recipient refused {to_email}: {error_message}")
+            # Permanent (5xx) refusals go on the suppression list so we stop retrying them
+            if any(code >= 500 for code, _ in e.recipients.values()):
+                with app.app_context():
+                    suppression_list.add(to_email, error_message)
             break  # Don't retry recipient errors
             
         except smtplib.SMTPServerDisconnected as e:
             error_message = f"SMTP server disconnected: {str(e)}"
             logger.warning(f"SMTP disconnected for {to_email} on attempt {attempt}: {error_message}")
-            time.sleep(1)  # Brief pause before retry
+            with trace.span("retry_wait", to_email):
+                time.sleep(1)  # Brief pause before retry
             
         except Exception as e:
             error_message = f"Unexpected error: {str(e)}"
             logger.warning(f"Attempt {attempt} failed to send email to {to_email}: {error_message}")
             if attempt < max_attempts:
-                time.sleep(1)  # Brief pause before retry
+                with trace.span("retry_wait", to_email):
+                    time.sleep(1)  # Brief pause before retry
 
     # All retries failed — log failure
-    with app.app_context():
+    with app.app_context(), trace.span("db_log", to_email):
         try:
             log = EmailLog(
                 from_email=from_email, 
@@ -242,22 +289,35 @@ def send_email_smtp(from_email, from_token, to_email, subject, body, content_typ
 
 
 def send_bulk_emails(from_role, to_list, subject, body, content_type="text/html", attachments=[], template_name=None):
+    trace = start_job_trace()
+    try:
+        with collect_queries(f"bulk job {trace.job_id}") as query_stats:
+            return run_bulk_job(trace, from_role, to_list, subject, body, content_type, attachments, template_name)
+    finally:
+        query_stats.log()
+        trace.flush(from_role=from_role, recipients=len(to_list), template=template_name,
+                    queries=query_stats.count, query_ms=round(query_stats.total_time * 1000, 1))
+
+
+def run_bulk_job(trace, from_role, to_list, subject, body, content_type="text/html", attachments=[], template_name=None):
     from app import app
     
     start_time = time.time()
-    logger.info(f"Starting bulk email job: role={from_role}, recipients={len(to_list)}")
+    logger.info(f"Starting bulk email job {trace.job_id}: role={from_role}, recipients={len(to_list)}" +
+                (" (traced)" if trace.sampled else ""))
     
     # Thread-safe collection for failed emails
     failed_emails_lock = Lock()
     failed_emails = []
     
-    from_email, from_token = fetch_sender_credentials(from_role)
+    with trace.span("fetch_sender_credentials"):
+        from_email, from_token = fetch_sender_credentials(from_role)
     if not from_email or not from_token:
         logger.error(f"Could not find credentials for role '{from_role}'")
         return False, failed_emails
 
     # Resolve recipients inside app context
-    with app.app_context():
+    with app.app_context(), trace.span("resolve_recipients"):
         recipients = resolve_recipients(to_list)
         if not recipients:
             logger.error("No valid recipients resolved from input list")
@@ -268,20 +328,38 @@ def send_bulk_emails(from_role, to_list, subject, body, content_type="text/html"
     dispatched_count = 0
     
     if attachments:
-        # Validate attachments exist before starting
-        valid_attachments = []
-        for path in attachments:
-            if os.path.exists(path):
-                valid_attachments.append(path)
-                logger.debug(f"Attachment validated: {os.path.basename(path)}")
-            else:
-                logger.warning(f"Attachment not found, skipping: {path}")
-        attachments = valid_attachments
-        
-        if attachments:
-            attachment_names = [os.path.basename(path) for path in attachments]
-            logger.info(f"Including {len(attachments)} attachment(s): {', '.join(attachment_names)}")
-    
+        # Never send a message stripped of its attachments; fail the job instead
+        missing = [path for path in attachments if not os.path.exists(path)]
+        if missing:
+            logger.error(f"Attachment(s) not found, failing all {len(recipients)} recipient(s): {', '.join(missing)}")
+            return False, list(recipients)
+
+        attachment_names = [os.path.basename(path) for path in attachments]
+        logger.info(f"Including {len(attachments)} attachment(s): {', '.join(attachment_names)}")
+
+    use_render_pool = template_name and len(recipients) >= RENDER_POOL_MIN_RECIPIENTS
+    template = None
+    variables_by_usn, variable_errors = {}, {}
+    if not use_render_pool:
+        if template_name:
+            # Load the template row once per job, not once per recipient
+            try:
+                with app.app_context(), trace.span("load_template"):
+                    template = load_template(template_name)
+            except Exception as e:
+                logger.error(f"Could not load template '{template_name}': {e}")
+                return False, list(recipients)
+
+        # Look up every USN's email/variables in batches instead of once per sender thread
+        usns = [r for r in recipients if not ('@' in r and is_valid_email(r))]
+        if usns:
+            try:
+                with app.app_context(), trace.span("fetch_template_variables_bulk"):
+                    variables_by_usn, variable_errors = fetch_template_variables_bulk(usns)
+            except Exception as e:
+                logger.error(f"Bulk template variable fetch failed: {e}", exc_info=True)
+                variable_errors = {usn: str(e) for usn in usns}
+
     def thread_wrapper(identifier):
         actual_email = identifier
         final_body = body or ""
@@ -296,18 +374,20 @@ def send_bulk_emails(from_role, to_list, subject, body, content_type="text/html"
                     # Use the email as-is and render template with minimal variables
                     logger.warning(f"Using template with direct email {identifier} - limited variable support")
                     variables = {"email": identifier, "name": identifier.split('@')[0]}
-                    final_body = load_and_render_template(template_name, variables)
+                    with trace.span("render_template", identifier):
+                        final_body = template.render(**variables)
                     actual_email = identifier
                 else:
-                    # Try fetching variables for USN
-                    variables, err = fetch_template_variables(identifier)
+                    # Variables for USNs were fetched in bulk above
+                    variables, err = variables_by_usn.get(identifier), variable_errors.get(identifier)
                     if err:
                         logger.warning(f"Template variable fetch error for {identifier}: {err}")
                         with failed_emails_lock:
                             failed_emails.append(identifier)
                         return
                         
-                    final_body = load_and_render_template(template_name, variables)
+                    with trace.span("render_template", identifier):
+                        final_body = template.render(**variables)
                     actual_email = variables.get("email")
                     if not actual_email or '@' not in actual_email:
                         logger.warning(f"No valid email found for: {identifier}")
@@ -321,8 +401,8 @@ def send_bulk_emails(from_role, to_list, subject, body, content_type="text/html"
                     actual_email = identifier
                     logger.debug(f"Using direct email: {actual_email}")
                 else:
-                    # USN - need to look up email
-                    variables, err = fetch_template_variables(identifier)
+                    # USN - email was looked up in bulk above
+                    variables, err = variables_by_usn.get(identifier), variable_errors.get(identifier)
                     if err:
                         logger.warning(f"Template variable fetch error for {identifier}: {err}")
                         with failed_emails_lock:
@@ -347,11 +427,15 @@ def send_bulk_emails(from_role, to_list, subject, body, content_type="text/html"
                 with failed_emails_lock:
                     failed_emails.append(actual_email)
                 return
+
+            if suppression_list.is_suppressed(actual_email):
+                logger.info(f"Skipping suppressed address: {actual_email}")
+                return
                 
             logger.debug(f"Sending to: {actual_email}")
             success, recipient = send_email_smtp(
                 from_email, from_token, actual_email, subject,
-                final_body, content_type, attachments
+                final_body, content_type, attachments, trace
             )
             if not success:
                 with failed_emails_lock:
@@ -363,25 +447,48 @@ def send_bulk_emails(from_role, to_list, subject, body, content_type="text/html"
             with failed_emails_lock:
                 failed_emails.append(identifier)
 
+    # Sender threads count their queries against this job (and the request)
+    collectors = current_collectors()
+
     def thread_launcher(identifier):
-        with app.app_context():
+        with app.app_context(), attach(collectors):
             thread_wrapper(identifier)            
 
-    # Create and start threads
-    for recipient in recipients:
-        logger.debug(f"Processing recipient: {recipient}")
-        thread = Thread(target=thread_launcher, args=(recipient,))
-        thread.start()
-        threads.append(thread)
-        dispatched_count += 1
+    if use_render_pool:
+        # Large templated send: render across processes, send from a fixed thread pool
+        with app.app_context():
+            failed_emails.extend(send_rendered_pipeline(
+                from_email, from_token, recipients, subject,
+                content_type, attachments, template_name, trace
+            ))
+    else:
+        # A fixed pool of sender threads drains the recipient queue
+        recipient_queue = Queue()
+        for recipient in recipients:
+            recipient_queue.put(recipient)
+            dispatched_count += 1
+
+        def sender_loop():
+            while True:
+                try:
+                    recipient = recipient_queue.get_nowait()
+                except Empty:
+                    return
+                logger.debug(f"Processing recipient: {recipient}")
+                thread_launcher(recipient)
 
-    logger.info(f"Dispatched {dispatched_count} emails, waiting for completion")
+        for _ in range(min(SENDER_THREADS, dispatched_count)):
+            thread = Thread(target=sender_loop)
+            thread.start()
+            threads.append(thread)
+
+        logger.info(f"Dispatched {dispatched_count} emails to {len(threads)} sender thread(s), waiting for completion")
     
-    # Wait for all threads to complete
-    for i, t in enumerate(threads):
-        t.join()
-        if (i+1) % 10 == 0 or (i+1) == len(threads):
-            logger.debug(f"Completed {i+1}/{len(threads)} email threads")
+        # Wait for all threads to complete
+        for i, t in enumerate(threads):
+            t.join()
+            if (i+1) % 10 == 0 or (i+1) == len(threads):
+                logger.debug(f"Completed {i+1}/{len(threads)} sender threads")
 
     elapsed_time = time.time() - start_time
     
@@ -396,6 +503,120 @@ def send_bulk_emails(from_role, to_list, subject, body, content_type="text/html"
         return True, []
 
 
+def send_rendered_pipeline(from_email, from_token, recipients, subject, content_type, attachments, template_name,
+                           trace=NULL_TRACE):
+    """
+    Render a templated send in a process pool and hand rendered bodies to a fixed
+    set of sender threads through a bounded queue. Must run inside an app context.
+    Returns the list of failed recipients.
+    """
+    from app import app
+
+    failed = []
+    failed_lock = Lock()
+
+    try:
+        raw_html = load_template_source(template_name)
+
+        # Resolve every recipient's variables up front with batched queries
+        usns = [r for r in recipients if not ('@' in r and is_valid_email(r))]
+        with trace.span("fetch_template_variables_bulk"):
+            variables_by_usn, errors = fetch_template_variables_bulk(usns)
+    except Exception as e:
+        # Same outcome as the thread path, where each recipient fails on its own
+        logger.error(f"Could not prepare templated send '{template_name}': {e}", exc_info=True)
+        return list(recipients)
+
+    jobs = []
+    for identifier in recipients:
+        if '@' in identifier and is_valid_email(identifier):
+            variables = {"email": identifier, "name": identifier.split('@')[0]}
+        elif identifier in errors:
+            logger.warning(f"Template variable fetch error for {identifier}: {errors[identifier]}")
+            failed.append(identifier)
+            continue
+        else:
+            variables = variables_by_usn[identifier]
+
+        actual_email = variables.get("email")
+        if not actual_email or not is_valid_email(actual_email):
+            logger.warning(f"No valid email found for: {identifier}")
+            failed.append(identifier)
+            continue
+        jobs.append((identifier, actual_email, variables))
+
+    try:
+        with trace.span("suppression_check"):
+            suppressed = suppression_list.filter_suppressed([email for _, email, _ in jobs])
+    except Exception as e:
+        logger.error(f"Suppression check failed for templated send: {e}", exc_info=True)
+        return failed + [identifier for identifier, _, _ in jobs]
+    if suppressed:
+        logger.info(f"Skipping {len(suppressed)} suppressed address(es)")
+        jobs = [job for job in jobs if job[1] not in suppressed]
+
+    if not jobs:
+        return failed
+
+    rendered_queue = Queue(maxsize=RENDER_QUEUE_SIZE)
+    handled = set()
+    collectors = current_collectors()
+
+    def sender_loop():
+        with app.app_context(), attach(collectors):
+            while True:
+                item = rendered_queue.get()
+                if item is None:
+                    break
+                identifier, actual_email, final_body, render_error = item
+                with failed_lock:
+                    handled.add(identifier)
+                try:
+                    if render_error:
+                        logger.warning(f"Template render failed for {identifier}: {render_error}")
+                        with failed_lock:
+                            failed.append(identifier)
+                        continue
+
+                    logger.debug(f"Sending to: {actual_email}")
+                    success, recipient = send_email_smtp(
+                        from_email, from_token, actual_email, subject,
+                        final_body, content_type, attachments, trace
+                    )
+                    if not success:
+                        with failed_lock:
+                            failed.append(recipient)
+                except Exception as e:
+                    logger.error(f"Sender thread error for {identifier}: {e}")
+                    logger.debug(f"Sender thread error traceback: {traceback.format_exc()}")
+                    with failed_lock:
+                        failed.append(identifier)
+
+    sender_count = min(SENDER_THREADS, len(jobs))
+    senders = [Thread(target=sender_loop) for _ in range(sender_count)]
+    for t in senders:
+        t.start()
+    logger.info(f"Started {sender_count} sender thread(s) for {len(jobs)} rendered message(s)")
+
+    try:
+        with trace.span("render_stage"):
+            render_to_queue(raw_html, jobs, rendered_queue)
+    except Exception as e:
+        logger.error(f"Render stage crashed: {e}", exc_info=True)
+    finally:
+        for _ in senders:
+            rendered_queue.put(None)
+        for t in senders:
+            t.join()
+
+    # Anything the render stage never produced counts as failed
+    for identifier, _, _ in jobs:
+        if identifier not in handled:
+            failed.append(identifier)
+
+    return failed
+
+
 def notify_admin_of_failure(failed_email, original_subject, error_message):
     from app import app, db
     
@@ -0,0 +1,87 @@
+# utils/leader.py
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from models import db, SchedulerLease
+from utils.logger import logger
+import atexit
+import os
+import socket
+import uuid
+
+# How long a lease stays valid without renewal; a dead leader is replaced after this
+LEASE_TTL_SECONDS = int(os.getenv("SCHEDULER_LEASE_TTL", 30))
+# How often the holder renews (and followers try to acquire)
+LEASE_RENEW_SECONDS = int(os.getenv("SCHEDULER_LEASE_RENEW", 10))
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class LeaderLease:
+    """
+    Database lease that elects one scheduler across all processes and nodes.
+    Every process calls renew() periodically; whoever holds an unexpired row
+    in scheduler_leases is the leader. Assumes node clocks are NTP-synced.
+    """
+
+    def __init__(self, app, name="scheduler", ttl=LEASE_TTL_SECONDS):
+        self.app = app
+        self.name = name
+        self.ttl = timedelta(seconds=ttl)
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._valid_until = None
+
+    def is_leader(self):
+        # Stop acting as leader locally as soon as our own lease would have expired
+        return self._valid_until is not None and _utcnow() < self._valid_until
+
+    def renew(self):
+        was_leader = self.is_leader()
+        with self.app.app_context():
+            now = _utcnow()
+            expires_at = now + self.ttl
+            try:
+                updated = SchedulerLease.query.filter(
+                    SchedulerLease.name == self.name,
+                    or_(SchedulerLease.holder == self.holder, SchedulerLease.expires_at < now)
+                ).update({"holder": self.holder, "expires_at": expires_at}, synchronize_session=False)
+
+                if not updated and not db.session.get(SchedulerLease, self.name):
+                    db.session.add(SchedulerLease(name=self.name, holder=self.holder, expires_at=expires_at))
+                    updated = 1
+
+                db.session.commit()
+                self._valid_until = expires_at if updated else None
+            except IntegrityError:
+                # Another process inserted the lease row first
+                db.session.rollback()
+                self._valid_until = None
+            except Exception as e:
+                db.session.rollback()
+                self._valid_until = None
+                logger.error(f"Failed to renew scheduler lease '{self.name}': {e}")
+
+        if self.is_leader() and not was_leader:
+            logger.info(f"Acquired scheduler lease '{self.name}' as {self.holder}")
+        elif was_leader and not self.is_leader():
+            logger.warning(f"Lost scheduler lease '{self.name}' held by {self.holder}")
+        return self.is_leader()
+
+    def release(self):
+        if not self.is_leader():
+            return
+        self._valid_until = None
+        with self.app.app_context():
+            try:
+                SchedulerLease.query.filter_by(name=self.name, holder=self.holder).delete()
+                db.session.commit()
+                logger.info(f"Released scheduler lease '{self.name}'")
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Failed to release scheduler lease '{self.name}': {e}")
+
+    def register_release_at_exit(self):
+        # Lets a follower take over immediately instead of waiting out the TTL
+        atexit.register(self.release)
@@ -0,0 +1,127 @@
+# utils/log_archive.py
+# Monthly archival of delivery logs. Each calendar month of email_logs (with its
+# email_status rows) is a logical partition; months older than the retention
+# window are written to archive/email_logs-YYYY-MM.jsonl.gz and then deleted.
+from datetime import datetime, timedelta, timezone
+from models import db, EmailLog, EmailStatus, EmailAttachment
+from utils.logger import logger
+import gzip
+import json
+import os
+
+# Months are archived once they end more than this many days ago
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", 180))
+ARCHIVE_DIR = os.getenv("LOG_ARCHIVE_DIR", "archive")
+ARCHIVE_BATCH_SIZE = int(os.getenv("LOG_ARCHIVE_BATCH_SIZE", 1000))
+
+
+def _month_start(dt):
+    return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(dt):
+    return (dt.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _serialize(log, status):
+    return {
+        "log_id": log.log_id,
+        "from_email": log.from_email,
+        "to_email": log.to_email,
+        "subject": log.subject,
+        "body": log.body,
+        "sent_at": log.sent_at.isoformat() if log.sent_at else None,
+        "status": log.status,
+        "error_message": log.error_message,
+        "tracking_id": status.tracking_id if status else None,
+        "opened": status.opened if status else None,
+        "opened_at": status.opened_at.isoformat() if status and status.opened_at else None,
+        "view_count": status.view_count if status else None,
+    }
+
+
+def _archived_ids(path):
+    """log_ids already in an archive file, left there by a run whose delete didn't commit."""
+    ids = set()
+    if not os.path.exists(path):
+        return ids
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                ids.add(json.loads(line)["log_id"])
+    except (EOFError, gzip.BadGzipFile, ValueError) as e:
+        # A run killed mid-write leaves a truncated member; rows after it are re-archived
+        logger.warning(f"Archive {path} is truncated after {len(ids)} row(s): {e}")
+    return ids
+
+
+def archive_month(month_start):
+    """Move one month of delivery logs to a compressed file. Must run inside an app context."""
+    month_end = _next_month(month_start)
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(ARCHIVE_DIR, f"email_logs-{month_start:%Y-%m}.jsonl.gz")
+
+    # Batches are written before their delete commits, so skip rows a failed run already wrote
+    already_archived = _archived_ids(path)
+    archived = 0
+    last_id = 0
+    while True:
+        # Keyset batches so each pass is an index range scan, not an OFFSET
+        logs = EmailLog.query.filter(
+            EmailLog.sent_at >= month_start,
+            EmailLog.sent_at < month_end,
+            EmailLog.log_id > last_id
+        ).order_by(EmailLog.log_id).limit(ARCHIVE_BATCH_SIZE).all()
+        if not logs:
+            break
+
+        ids = [log.log_id for log in logs]
+        statuses = {s.email_log_id: s for s in EmailStatus.query.filter(EmailStatus.email_log_id.in_(ids)).all()}
+
+        # Append a gzip member per batch; the file stays readable as one stream
+        with gzip.open(path, 'at', encoding='utf-8') as f:
+            for log in logs:
+                if log.log_id not in already_archived:
+                    f.write(json.dumps(_serialize(log, statuses.get(log.log_id)), separators=(",", ":")) + "\n")
+
+        try:
+            EmailAttachment.query.filter(EmailAttachment.email_id.in_(ids)).update(
+                {"email_id": None}, synchronize_session=False)
+            EmailStatus.query.filter(EmailStatus.email_log_id.in_(ids)).delete(synchronize_session=False)
+            EmailLog.query.filter(EmailLog.log_id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        archived += len(ids)
+        last_id = ids[-1]
+
+    if archived:
+        logger.info(f"Archived {archived} delivery log(s) for {month_start:%Y-%m} to {path}")
+    return archived
+
+
+def archive_old_logs(app, lease=None):
+    # Runs on every worker's scheduler; only the leader archives
+    if lease is not None and not lease.is_leader():
+        return 0
+
+    with app.app_context():
+        cutoff = _month_start(datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=LOG_RETENTION_DAYS))
+        oldest = db.session.query(db.func.min(EmailLog.sent_at)).filter(EmailLog.sent_at < cutoff).scalar()
+        if not oldest:
+            return 0
+
+        total = 0
+        month = _month_start(oldest)
+        while month < cutoff:
+            try:
+                total += archive_month(month)
+            except Exception as e:
+                logger.error(f"Failed to archive delivery logs for {month:%Y-%m}: {e}", exc_info=True)
+                break
+            month = _next_month(month)
+
+        logger.info(f"Delivery log archival complete: {total} row(s) older than {cutoff:%Y-%m-%d} archived")
+        return total
@@ -0,0 +1,36 @@
+# utils/migrate.py
+# One-off schema step to run once per deploy, before starting workers:
+#   python -m utils.migrate
+# Creates missing tables and builds missing indexes (CONCURRENTLY on PostgreSQL),
+# so web workers never run DDL against large tables at startup.
+from sqlalchemy import inspect
+from models import db, ensure_indexes, RosterStaging
+from utils.logger import logger
+import sys
+
+
+def _relax_roster_staging():
+    # roster_staging.group_name became nullable; the table only holds in-flight
+    # imports, so an old copy is rebuilt rather than altered
+    columns = {c["name"]: c for c in inspect(db.engine).get_columns(RosterStaging.__tablename__)}
+    if not columns.get("group_name", {}).get("nullable", True):
+        logger.info("Migration: recreating roster_staging with nullable group_name")
+        RosterStaging.__table__.drop(db.engine)
+        RosterStaging.__table__.create(db.engine)
+
+
+def main():
+    from app import app
+
+    with app.app_context():
+        logger.info("Migration: creating missing tables")
+        db.create_all()
+        _relax_roster_staging()
+        logger.info("Migration: building missing indexes")
+        ensure_indexes()
+    print("Schema is up to date")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+# utils/query_stats.py
+# Per-request / per-job SQL statement counting and N+1 detection.
+from collections import Counter
+from contextlib import contextmanager, ContextDecorator
+from threading import Lock, local
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import os
+import re
+import time
+from utils.logger import logger
+
+# A statement shape repeated this many times in one scope is reported as a likely N+1
+REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", 5))
+# Add X-DB-* headers to every response (always on when app.debug is set)
+QUERY_STATS_HEADERS = os.getenv("QUERY_STATS_HEADERS", "false").lower() == "true"
+# Raise instead of logging when a declared query budget is exceeded (set this in tests)
+QUERY_BUDGET_STRICT = os.getenv("QUERY_BUDGET_STRICT", "false").lower() == "true"
+
+_PARAM = r"(?:\?|%s|%\(\w+\)s|:\w+)"
+_PARAM_LIST = re.compile(r"\(\s*" + _PARAM + r"(?:\s*,\s*" + _PARAM + r")*\s*\)")
+_NUMBER = re.compile(r"\b\d+\b")
+_WHITESPACE = re.compile(r"\s+")
+
+_local = local()
+
+
+def statement_shape(statement):
+    """Collapse IN-lists, numbers and whitespace so N+1 repeats share one shape."""
+    shape = _WHITESPACE.sub(" ", statement).strip()
+    shape = _PARAM_LIST.sub("(...)", shape)
+    return _NUMBER.sub("N", shape)
+
+
+class QueryStats:
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.total_time = 0.0
+        self.shapes = Counter()
+        self._lock = Lock()
+
+    def record(self, statement, duration):
+        shape = statement_shape(statement)
+        with self._lock:
+            self.count += 1
+            self.total_time += duration
+            self.shapes[shape] += 1
+
+    def repeated(self, threshold=REPEAT_THRESHOLD):
+        with self._lock:
+            return [(shape, n) for shape, n in self.shapes.most_common() if n >= threshold]
+
+    def max_repeats(self):
+        with self._lock:
+            return max(self.shapes.values(), default=0)
+
+    def summary(self):
+        return f"{self.name}: {self.count} queries in {self.total_time * 1000:.1f}ms, {len(self.shapes)} distinct"
+
+    def log(self):
+        repeated = self.repeated()
+        if repeated:
+            logger.warning(f"{self.summary()}; possible N+1: " +
+                           "; ".join(f"{n}x {shape[:120]}" for shape, n in repeated[:3]))
+        else:
+            logger.debug(self.summary())
+
+
+def current_collectors():
+    return getattr(_local, "collectors", ())
+
+
+@contextmanager
+def attach(collectors):
+    """Record this thread's queries into collectors started on another thread."""
+    previous = current_collectors()
+    _local.collectors = tuple(collectors)
+    try:
+        yield
+    finally:
+        _local.collectors = previous
+
+
+@contextmanager
+def collect_queries(name):
+    """Count queries issued by this thread (and threads that attach()) inside the block."""
+    stats = QueryStats(name)
+    with attach(current_collectors() + (stats,)):
+        yield stats
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class query_budget(ContextDecorator):
+    """
+    Declare how many statements a block or function may issue. Usable as a
+    decorator on hot paths and as a context manager in tests:
+
+        with query_budget(max_queries=2, strict=True):
+            track_open(tracking_id)
+    """
+
+    def __init__(self, max_queries=None, max_repeats=None, name=None, strict=None):
+        self.max_queries = max_queries
+        self.max_repeats = max_repeats
+        self.name = name
+        self.strict = QUERY_BUDGET_STRICT if strict is None else strict
+
+    def __call__(self, func):
+        self.name = self.name or func.__qualname__
+        return super().__call__(func)
+
+    def __enter__(self):
+        # Decorated functions can re-enter on other threads, so keep state per thread
+        stack = getattr(_local, "budgets", [])
+        _local.budgets = stack
+        ctx = collect_queries(self.name or "query_budget")
+        stack.append((ctx, ctx.__enter__()))
+        return stack[-1][1]
+
+    def __exit__(self, exc_type, exc, tb):
+        ctx, stats = _local.budgets.pop()
+        ctx.__exit__(exc_type, exc, tb)
+        if exc_type is not None:
+            return False
+
+        problems = []
+        if self.max_queries is not None and stats.count > self.max_queries:
+            problems.append(f"{stats.count} queries (budget {self.max_queries})")
+        if self.max_repeats is not None and stats.max_repeats() > self.max_repeats:
+            shape, n = stats.shapes.most_common(1)[0]
+            problems.append(f"{n}x repeated statement (budget {self.max_repeats}): {shape[:120]}")
+        if problems:
+            message = f"Query budget exceeded in {stats.name}: " + "; ".join(problems)
+            if self.strict:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return False
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_collectors():
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    collectors = current_collectors()
+    starts = conn.info.get("query_start")
+    if not collectors or not starts:
+        return
+    duration = time.perf_counter() - starts.pop()
+    for stats in collectors:
+        stats.record(statement, duration)
+
+
+def init_app(app):
+    """Collect per-request query stats; expose them as headers in debug mode."""
+
+    @app.before_request
+    def _start_request_stats():
+        g._query_stats_ctx = collect_queries(f"{request.method} {request.path}")
+        g.query_stats = g._query_stats_ctx.__enter__()
+
+    @app.after_request
+    def _report_request_stats(response):
+        stats = g.get("query_stats")
+        if stats is not None:
+            stats.log()
+            if app.debug or QUERY_STATS_HEADERS:
+                response.headers["X-DB-Queries"] = str(stats.count)
+                response.headers["X-DB-Time-ms"] = f"{stats.total_time * 1000:.1f}"
+                response.headers["X-DB-Max-Repeats"] = str(stats.max_repeats())
+        return response
+
+    @app.teardown_request
+    def _stop_request_stats(exc):
+        ctx = g.pop("_query_stats_ctx", None)
+        if ctx is not None:
+            ctx.__exit__(None, None, None)
@@ -0,0 +1,82 @@
+# utils/render_pool.py
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from jinja2 import Template
+import multiprocessing
+import os
+from utils.logger import logger
+
+# Number of rendering processes (defaults to one per core)
+RENDER_PROCESSES = int(os.getenv("RENDER_PROCESSES", os.cpu_count() or 1))
+# Recipients rendered per task sent to a worker process
+RENDER_BATCH_SIZE = int(os.getenv("RENDER_BATCH_SIZE", 200))
+# Templated sends smaller than this are rendered inline; pool startup isn't worth it
+RENDER_POOL_MIN_RECIPIENTS = int(os.getenv("RENDER_POOL_MIN_RECIPIENTS", 500))
+
+# Compiled once per worker process by _init_worker
+_worker_template = None
+
+
+def _init_worker(raw_html):
+    global _worker_template
+    _worker_template = Template(raw_html)
+
+
+def _render_batch(batch):
+    """Render (identifier, email, variables) jobs; returns (identifier, email, body, error)."""
+    results = []
+    for identifier, email, variables in batch:
+        try:
+            results.append((identifier, email, _worker_template.render(**variables), None))
+        except Exception as e:
+            results.append((identifier, email, None, str(e)))
+    return results
+
+
+def _batches(jobs, size):
+    for start in range(0, len(jobs), size):
+        yield jobs[start:start + size]
+
+
+def render_to_queue(raw_html, jobs, out_queue):
+    """
+    Render jobs across a process pool and put each result on out_queue.
+    out_queue should be bounded so rendering can't run far ahead of the senders.
+    Returns the number of jobs rendered.
+    """
+    if len(jobs) < RENDER_POOL_MIN_RECIPIENTS or RENDER_PROCESSES <= 1:
+        logger.info(f"Rendering {len(jobs)} message(s) inline")
+        _init_worker(raw_html)
+        for result in _render_batch(jobs):
+            out_queue.put(result)
+        return len(jobs)
+
+    processes = min(RENDER_PROCESSES, -(-len(jobs) // RENDER_BATCH_SIZE))
+    logger.info(f"Rendering {len(jobs)} message(s) across {processes} process(es) "
+                f"in batches of {RENDER_BATCH_SIZE}")
+
+    # spawn avoids forking a process that is running sender and scheduler threads
+    context = multiprocessing.get_context("spawn")
+    rendered = 0
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context,
+                             initializer=_init_worker, initargs=(raw_html,)) as pool:
+        pending = set()
+        batches = _batches(jobs, RENDER_BATCH_SIZE)
+
+        # Keep only a couple of batches per process in flight so memory stays bounded
+        for batch in batches:
+            pending.add(pool.submit(_render_batch, batch))
+            if len(pending) >= processes * 2:
+                break
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for result in future.result():
+                    out_queue.put(result)
+                    rendered += 1
+                next_batch = next(batches, None)
+                if next_batch is not None:
+                    pending.add(pool.submit(_render_batch, next_batch))
+
+    logger.info(f"Rendered {rendered} message(s)")
+    return rendered
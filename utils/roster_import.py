@@ -0,0 +1,244 @@
+# utils/roster_import.py
+# Bulk roster sync for email_groups / group_members.
+#
+# CSV columns: group_id, usn, email, and optionally group_name, group_description.
+# Rows are streamed into roster_staging (COPY on PostgreSQL, executemany
+# elsewhere), then one short transaction applies a set-based diff: create
+# groups, rename/re-describe them where the CSV gives a new value, update
+# changed emails, delete members who left and insert new ones. Unchanged rows
+# are never touched, so senders reading group_members are not blocked.
+#
+# Modes decide which members a missing row deletes:
+#   groups (default)  only groups that appear in the CSV are synced; other
+#                     groups' members are left alone
+#   full              the CSV is the whole roster; members of every group
+#                     not listed in it are deleted (groups themselves are kept)
+#
+# Run from the command line with: python -m utils.roster_import [--full] roster.csv
+from sqlalchemy import text
+from models import db, RosterStaging
+from utils.logger import logger
+import csv
+import io
+import re
+import sys
+import time
+import uuid
+
+STAGING_CHUNK_SIZE = 5000
+REQUIRED_COLUMNS = {"group_id", "usn", "email"}
+STAGING_COLUMNS = ["import_id", "group_id", "usn", "group_name", "group_description", "email"]
+
+_EMAIL = re.compile(r"^[\w\.-]+@[\w\.-]+\.\w+$")
+
+
+class RosterImportError(ValueError):
+    pass
+
+
+IMPORT_MODES = ("groups", "full")
+
+# Each statement is scoped to one import via :import_id
+_GROUP_STEPS = [
+    ("groups_created", """
+        INSERT INTO email_groups (group_id, name, description)
+        SELECT s.group_id, COALESCE(MIN(s.group_name), s.group_id), MIN(s.group_description)
+        FROM roster_staging s
+        WHERE s.import_id = :import_id
+          AND NOT EXISTS (SELECT 1 FROM email_groups g WHERE g.group_id = s.group_id)
+        GROUP BY s.group_id
+    """),
+    ("groups_renamed", """
+        UPDATE email_groups
+        SET name = (SELECT MIN(s.group_name) FROM roster_staging s
+                    WHERE s.import_id = :import_id AND s.group_id = email_groups.group_id)
+        WHERE EXISTS (SELECT 1 FROM roster_staging s
+                      WHERE s.import_id = :import_id AND s.group_id = email_groups.group_id
+                        AND s.group_name IS NOT NULL AND s.group_name <> email_groups.name)
+    """),
+    ("groups_described", """
+        UPDATE email_groups
+        SET description = (SELECT MIN(s.group_description) FROM roster_staging s
+                           WHERE s.import_id = :import_id AND s.group_id = email_groups.group_id)
+        WHERE EXISTS (SELECT 1 FROM roster_staging s
+                      WHERE s.import_id = :import_id AND s.group_id = email_groups.group_id
+                        AND s.group_description IS NOT NULL
+                        AND (email_groups.description IS NULL
+                             OR s.group_description <> email_groups.description))
+    """),
+    ("members_updated", """
+        UPDATE group_members
+        SET email = (SELECT s.email FROM roster_staging s
+                     WHERE s.import_id = :import_id
+                       AND s.group_id = group_members.group_id AND s.usn = group_members.usn)
+        WHERE EXISTS (SELECT 1 FROM roster_staging s
+                      WHERE s.import_id = :import_id
+                        AND s.group_id = group_members.group_id AND s.usn = group_members.usn
+                        AND s.email <> group_members.email)
+    """),
+]
+
+_DELETE_STEPS = {
+    "groups": ("members_deleted", """
+        DELETE FROM group_members
+        WHERE group_id IN (SELECT DISTINCT s.group_id FROM roster_staging s WHERE s.import_id = :import_id)
+          AND NOT EXISTS (SELECT 1 FROM roster_staging s
+                          WHERE s.import_id = :import_id
+                            AND s.group_id = group_members.group_id AND s.usn = group_members.usn)
+    """),
+    "full": ("members_deleted", """
+        DELETE FROM group_members
+        WHERE NOT EXISTS (SELECT 1 FROM roster_staging s
+                          WHERE s.import_id = :import_id
+                            AND s.group_id = group_members.group_id AND s.usn = group_members.usn)
+    """),
+}
+
+_INSERT_STEP = ("members_inserted", """
+    INSERT INTO group_members (group_id, usn, email)
+    SELECT s.group_id, s.usn, s.email
+    FROM roster_staging s
+    WHERE s.import_id = :import_id
+      AND NOT EXISTS (SELECT 1 FROM group_members m
+                      WHERE m.group_id = s.group_id AND m.usn = s.usn)
+""")
+
+
+def _apply_steps(mode):
+    return _GROUP_STEPS + [_DELETE_STEPS[mode], _INSERT_STEP]
+
+
+def _parse_rows(text_stream, import_id, report):
+    """Yield staging rows from a CSV stream, skipping invalid and duplicate rows."""
+    reader = csv.DictReader(text_stream)
+    columns = {c.strip() for c in (reader.fieldnames or [])}
+    missing = REQUIRED_COLUMNS - columns
+    if missing:
+        raise RosterImportError(f"Missing CSV column(s): {', '.join(sorted(missing))}")
+
+    seen = set()
+    for line_no, raw in enumerate(reader, start=2):
+        row = {k.strip(): (v or "").strip() for k, v in raw.items() if k}
+        group_id, usn, email = row.get("group_id"), row.get("usn"), row.get("email")
+        if not group_id or not usn or not email or not _EMAIL.match(email):
+            report["rows_skipped"] += 1
+            logger.debug(f"Roster line {line_no} skipped: {raw}")
+            continue
+        if (group_id, usn) in seen:
+            report["duplicates"] += 1
+            continue
+        seen.add((group_id, usn))
+        report["rows"] += 1
+        yield {
+            "import_id": import_id,
+            "group_id": group_id,
+            "usn": usn,
+            "group_name": row.get("group_name") or None,
+            "group_description": row.get("group_description") or None,
+            "email": email,
+        }
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _copy_chunk(conn, chunk):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in chunk:
+        writer.writerow([row[c] if row[c] is not None else "" for c in STAGING_COLUMNS])
+    buffer.seek(0)
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY roster_staging ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+    finally:
+        cursor.close()
+
+
+def _stage(rows):
+    insert = RosterStaging.__table__.insert()
+    with db.engine.begin() as conn:
+        use_copy = conn.dialect.name == "postgresql" and conn.dialect.driver == "psycopg2"
+        for chunk in _chunks(rows, STAGING_CHUNK_SIZE):
+            if use_copy:
+                _copy_chunk(conn, chunk)
+            else:
+                conn.execute(insert, chunk)
+
+
+def _clear_staging(import_id):
+    with db.engine.begin() as conn:
+        conn.execute(text("DELETE FROM roster_staging WHERE import_id = :import_id"), {"import_id": import_id})
+
+
+def import_roster(text_stream, mode="groups"):
+    """
+    Stream a CSV roster into staging and apply it in one transaction.
+    mode is "groups" (default) or "full"; see the module header.
+    Must run inside an app context. Returns a report of counts and timings.
+    """
+    if mode not in IMPORT_MODES:
+        raise RosterImportError(f"Unknown import mode '{mode}'; use one of: {', '.join(IMPORT_MODES)}")
+    import_id = uuid.uuid4().hex
+    report = {"import_id": import_id, "mode": mode, "rows": 0, "rows_skipped": 0, "duplicates": 0}
+    logger.info(f"Roster import {import_id} started ({mode} mode)")
+
+    try:
+        start = time.time()
+        _stage(_parse_rows(text_stream, import_id, report))
+        report["stage_seconds"] = round(time.time() - start, 3)
+        if not report["rows"]:
+            raise RosterImportError("Roster contains no valid rows")
+
+        start = time.time()
+        with db.engine.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                # Give up rather than queue behind a long-running writer
+                conn.execute(text("SET LOCAL lock_timeout = '5s'"))
+            for name, statement in _apply_steps(mode):
+                report[name] = conn.execute(text(statement), {"import_id": import_id}).rowcount
+            conn.execute(text("DELETE FROM roster_staging WHERE import_id = :import_id"), {"import_id": import_id})
+        report["apply_seconds"] = round(time.time() - start, 3)
+    except Exception:
+        _clear_staging(import_id)
+        logger.error(f"Roster import {import_id} failed", exc_info=True)
+        raise
+
+    logger.info(f"Roster import {import_id} complete: " +
+                ", ".join(f"{k}={v}" for k, v in report.items() if k != "import_id"))
+    return report
+
+
+def main(argv):
+    mode = "full" if "--full" in argv else "groups"
+    argv = [arg for arg in argv if arg != "--full"]
+    if len(argv) != 1:
+        print("Usage: python -m utils.roster_import [--full] <roster.csv>")
+        print("  --full  treat the CSV as the whole roster and delete members of unlisted groups")
+        return 1
+    from app import app
+
+    with app.app_context(), open(argv[0], encoding="utf-8-sig", newline="") as f:
+        try:
+            report = import_roster(f, mode)
+        except RosterImportError as e:
+            print(f"Import failed: {e}")
+            return 1
+    for key, value in report.items():
+        print(f"{key}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,193 @@
+# utils/suppression.py
+# Suppression list for addresses that must not be mailed (hard bounces, opt-outs).
+# Manage entries with: python -m utils.suppression add|remove|check <email> [reason]
+from sqlalchemy.exc import IntegrityError
+from threading import Lock
+from models import db, SuppressedAddress
+from utils.logger import logger
+from utils.variable_resolver import BULK_LOOKUP_CHUNK
+import hashlib
+import math
+import os
+import sys
+import time
+
+# Seconds between incremental refreshes from the suppressed_addresses table
+SUPPRESSION_REFRESH_SECONDS = int(os.getenv("SUPPRESSION_REFRESH_SECONDS", 60))
+# Ids below the highest one seen that every refresh re-reads, for late commits
+SUPPRESSION_REFRESH_OVERLAP = int(os.getenv("SUPPRESSION_REFRESH_OVERLAP", 1000))
+# Seconds between full reloads of the filter
+SUPPRESSION_REBUILD_SECONDS = int(os.getenv("SUPPRESSION_REBUILD_SECONDS", 3600))
+# Initial Bloom filter sizing; the filter is rebuilt larger when outgrown
+SUPPRESSION_CAPACITY = int(os.getenv("SUPPRESSION_CAPACITY", 100000))
+SUPPRESSION_ERROR_RATE = float(os.getenv("SUPPRESSION_ERROR_RATE", 0.001))
+
+
+def normalize_email(email):
+    return (email or "").strip().lower()
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter using double hashing over one blake2b digest."""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class SuppressionList:
+    """
+    Per-process Bloom filter in front of the shared suppressed_addresses table.
+    The filter answers "definitely not suppressed" without touching the database;
+    possible hits are confirmed against the table. Each worker pulls new rows
+    incrementally by id (re-reading a trailing window for late commits) and
+    reloads in full periodically, so all workers converge on the same list.
+    """
+
+    def __init__(self, capacity=SUPPRESSION_CAPACITY, error_rate=SUPPRESSION_ERROR_RATE):
+        self._capacity = capacity
+        self._error_rate = error_rate
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._last_id = 0
+        # Ids already loaded from the trailing overlap window, so they aren't counted twice
+        self._recent_ids = set()
+        self._last_refresh = 0
+        self._last_rebuild = time.time()
+        self._lock = Lock()
+
+    def refresh(self, force=False):
+        """Load rows added since the last refresh. Must run inside an app context."""
+        with self._lock:
+            if not force and time.time() - self._last_refresh < SUPPRESSION_REFRESH_SECONDS:
+                return
+            try:
+                if time.time() - self._last_rebuild >= SUPPRESSION_REBUILD_SECONDS:
+                    # Periodic full reload catches anything the overlap window missed
+                    self._rebuild(self._bloom.count)
+                    self._last_refresh = time.time()
+                    return
+
+                # Ids can commit out of order under concurrent add()s, so re-read a
+                # trailing window below the highest id seen instead of starting after it
+                rows = db.session.query(SuppressedAddress.id, SuppressedAddress.email).filter(
+                    SuppressedAddress.id > self._last_id - SUPPRESSION_REFRESH_OVERLAP
+                ).order_by(SuppressedAddress.id).all()
+            except Exception as e:
+                logger.error(f"Failed to refresh suppression list: {e}")
+                return
+
+            new_rows = [(row_id, email) for row_id, email in rows if row_id not in self._recent_ids]
+            if self._bloom.count + len(new_rows) > self._bloom.capacity:
+                self._rebuild(self._bloom.count + len(new_rows))
+            else:
+                for row_id, email in new_rows:
+                    self._bloom.add(normalize_email(email))
+                    self._last_id = max(self._last_id, row_id)
+                self._recent_ids = {row_id for row_id, _ in rows
+                                    if row_id > self._last_id - SUPPRESSION_REFRESH_OVERLAP}
+            self._last_refresh = time.time()
+            if new_rows:
+                logger.info(f"Suppression list refreshed: +{len(new_rows)} address(es), {self._bloom.count} total")
+
+    def _rebuild(self, needed):
+        # Caller holds the lock; reload everything into a filter twice the size needed
+        self._capacity = max(self._capacity, needed * 2)
+        bloom = BloomFilter(self._capacity, self._error_rate)
+        ids = []
+        for row_id, email in db.session.query(SuppressedAddress.id, SuppressedAddress.email).yield_per(5000):
+            bloom.add(normalize_email(email))
+            ids.append(row_id)
+        last_id = max(ids, default=0)
+        self._bloom, self._last_id = bloom, last_id
+        self._recent_ids = {row_id for row_id in ids if row_id > last_id - SUPPRESSION_REFRESH_OVERLAP}
+        self._last_rebuild = time.time()
+        logger.info(f"Suppression filter rebuilt for capacity {self._capacity} ({bloom.count} address(es))")
+
+    def filter_suppressed(self, emails):
+        """Return the subset of emails that are suppressed. Must run inside an app context."""
+        self.refresh()
+        candidates = list({normalize_email(e) for e in emails if normalize_email(e) in self._bloom})
+        if not candidates:
+            return set()
+
+        confirmed = set()
+        for start in range(0, len(candidates), BULK_LOOKUP_CHUNK):
+            chunk = candidates[start:start + BULK_LOOKUP_CHUNK]
+            rows = db.session.query(SuppressedAddress.email).filter(SuppressedAddress.email.in_(chunk)).all()
+            confirmed.update(normalize_email(email) for (email,) in rows)
+        return {e for e in emails if normalize_email(e) in confirmed}
+
+    def is_suppressed(self, email):
+        return bool(self.filter_suppressed([email]))
+
+    def add(self, email, reason=None):
+        """Record a suppressed address. Must run inside an app context."""
+        email = normalize_email(email)
+        row_id = None
+        try:
+            row = SuppressedAddress(email=email, reason=reason)
+            db.session.add(row)
+            db.session.commit()
+            row_id = row.id
+            logger.info(f"Suppressed address added: {email}")
+        except IntegrityError:
+            db.session.rollback()
+            logger.debug(f"Address already suppressed: {email}")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Failed to suppress {email}: {e}")
+            return
+        with self._lock:
+            self._bloom.add(email)
+            if row_id is not None:
+                # Already in the filter, so the next refresh mustn't add (and count) it again
+                self._recent_ids.add(row_id)
+
+    def remove(self, email):
+        # The Bloom bit stays set; the exact table check makes the address sendable again
+        email = normalize_email(email)
+        deleted = SuppressedAddress.query.filter_by(email=email).delete()
+        db.session.commit()
+        return bool(deleted)
+
+
+suppression_list = SuppressionList()
+
+
+def main(argv):
+    if len(argv) < 2 or argv[0] not in ("add", "remove", "check"):
+        print("Usage: python -m utils.suppression add|remove|check <email> [reason]")
+        return 1
+    from app import app
+
+    command, email = argv[0], argv[1]
+    with app.app_context():
+        if command == "add":
+            suppression_list.add(email, " ".join(argv[2:]) or "manual")
+            print(f"Suppressed {email}")
+        elif command == "remove":
+            print(f"Removed {email}" if suppression_list.remove(email) else f"{email} was not suppressed")
+        else:
+            print(f"{email} is {'suppressed' if suppression_list.is_suppressed(email) else 'not suppressed'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -2,8 +2,10 @@
 from jinja2 import Template
 from models import EmailTemplate
 from utils.logger import logger
+from utils.query_stats import query_budget
 
-def load_and_render_template(template_name, variables={}):
+@query_budget(max_queries=1)
+def load_template_source(template_name):
     logger.info(f"Loading template: {template_name}")
     
     template_obj = EmailTemplate.query.filter_by(name=template_name).first()
@@ -19,7 +21,14 @@ def load_and_render_template(template_name, variables={}):
         logger.error(f"Template file not found: {template_obj.file_path}")
         raise FileNotFoundError(f"File {template_obj.file_path} not found on disk.")
 
-    template = Template(raw_html)
+    return raw_html
+
+def load_template(template_name):
+    """Compiled template for rendering many recipients; safe to share across threads."""
+    return Template(load_template_source(template_name))
+
+def load_and_render_template(template_name, variables={}):
+    template = load_template(template_name)
     rendered = template.render(**variables)
     logger.debug(f"Template rendered successfully")
-    return rendered
\ No newline at end of file
+    return rendered
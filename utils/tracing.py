@@ -0,0 +1,154 @@
+# utils/tracing.py
+# Lightweight per-job span tracing for bulk sends.
+# Print a job's waterfall with: python -m utils.tracing <job_id>
+from contextlib import contextmanager
+from datetime import datetime
+from threading import Lock, current_thread
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from utils.logger import logger
+
+# Fraction of bulk jobs that get traced
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.1))
+# Where sampled traces are appended, one JSON line per job
+TRACE_DIR = os.getenv("TRACE_DIR", "traces")
+# Spans kept per job; the rest are counted but dropped
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", 20000))
+
+
+class JobTrace:
+    """Collects (name, recipient, start, duration, thread) spans for one job in memory."""
+
+    def __init__(self, job_id, sampled):
+        self.job_id = job_id
+        self.sampled = sampled
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self._spans = []
+        self._dropped = 0
+        self._lock = Lock()
+
+    @contextmanager
+    def span(self, name, recipient=None):
+        if not self.sampled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter(), recipient)
+
+    def record(self, name, start, end, recipient=None):
+        if not self.sampled:
+            return
+        span = [name, recipient, round((start - self._t0) * 1000, 2),
+                round((end - start) * 1000, 2), current_thread().name]
+        with self._lock:
+            if len(self._spans) < TRACE_MAX_SPANS:
+                self._spans.append(span)
+            else:
+                self._dropped += 1
+
+    def flush(self, **meta):
+        if not self.sampled:
+            return
+        with self._lock:
+            spans, dropped = self._spans, self._dropped
+            self._spans, self._dropped = [], 0
+
+        record = {
+            "job_id": self.job_id,
+            "started_at": self.started_at,
+            "total_ms": round((time.perf_counter() - self._t0) * 1000, 2),
+            "meta": meta,
+            "dropped": dropped,
+            # Compact rows: [name, recipient, start_ms, duration_ms, thread]
+            "spans": spans,
+        }
+        try:
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            day = datetime.fromtimestamp(self.started_at).strftime("%Y-%m-%d")
+            path = os.path.join(TRACE_DIR, f"traces-{day}.jsonl")
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+            logger.debug(f"Trace for job {self.job_id} written to {path} ({len(spans)} spans)")
+        except Exception as e:
+            logger.error(f"Failed to write trace for job {self.job_id}: {e}")
+
+
+NULL_TRACE = JobTrace(job_id=None, sampled=False)
+
+
+def start_job_trace(job_id=None):
+    job_id = job_id or uuid.uuid4().hex[:12]
+    return JobTrace(job_id, sampled=random.random() < TRACE_SAMPLE_RATE)
+
+
+def load_trace(job_id, trace_dir=TRACE_DIR):
+    if not os.path.isdir(trace_dir):
+        return None
+    for name in sorted(os.listdir(trace_dir), reverse=True):
+        if not name.endswith(".jsonl"):
+            continue
+        with open(os.path.join(trace_dir, name), encoding="utf-8") as f:
+            for line in f:
+                if f'"job_id":"{job_id}"' in line:
+                    return json.loads(line)
+    return None
+
+
+def format_trace(record, limit=200, width=50):
+    spans = sorted(record["spans"], key=lambda s: s[2])
+    total = max(record["total_ms"], 1)
+    lines = [
+        f"Job {record['job_id']} started {datetime.fromtimestamp(record['started_at'])} "
+        f"total {record['total_ms']:.1f}ms, {len(spans)} spans"
+        + (f" ({record['dropped']} dropped)" if record.get("dropped") else ""),
+    ]
+    if record.get("meta"):
+        lines.append("  " + ", ".join(f"{k}={v}" for k, v in record["meta"].items()))
+
+    # Stage breakdown
+    stages = {}
+    for name, _, _, duration, _ in spans:
+        stages.setdefault(name, []).append(duration)
+    lines.append("")
+    lines.append(f"{'stage':<32}{'count':>8}{'total ms':>12}{'avg ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for name, durations in sorted(stages.items(), key=lambda kv: -sum(kv[1])):
+        durations.sort()
+        p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+        lines.append(f"{name:<32}{len(durations):>8}{sum(durations):>12.1f}"
+                     f"{sum(durations) / len(durations):>10.1f}{p95:>10.1f}{durations[-1]:>10.1f}")
+
+    # Waterfall
+    lines.append("")
+    for name, recipient, start, duration, thread in spans[:limit]:
+        offset = int(start / total * width)
+        bar = "#" * max(1, int(duration / total * width))
+        label = f"{name}" + (f" [{recipient}]" if recipient else "")
+        lines.append(f"{start:>10.1f}ms {' ' * offset}{bar:<{width - offset}} {duration:>9.1f}ms {label} ({thread})")
+    if len(spans) > limit:
+        lines.append(f"... {len(spans) - limit} more spans (use --limit)")
+    return "\n".join(lines)
+
+
+def main(argv):
+    if not argv or argv[0] in ("-h", "--help"):
+        print("Usage: python -m utils.tracing <job_id> [--limit N]")
+        return 1
+    limit = int(argv[argv.index("--limit") + 1]) if "--limit" in argv else 200
+    record = load_trace(argv[0])
+    if not record:
+        print(f"No trace found for job {argv[0]} in {TRACE_DIR}/ (it may not have been sampled)")
+        return 1
+    print(format_trace(record, limit=limit))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -2,7 +2,12 @@
 from models import GroupMember, Group
 from flask import current_app
 from utils.logger import logger
+from utils.query_stats import query_budget
 
+# Keep IN (...) lists well under driver bind-parameter limits
+BULK_LOOKUP_CHUNK = 1000
+
+@query_budget(max_queries=2)
 def fetch_template_variables(usn):
     """
     Fetches template variables for a given USN by querying the database.
@@ -38,4 +43,38 @@ def fetch_template_variables(usn):
     logger.info(f"Successfully resolved template variables for USN: {usn}")
     logger.debug(f"Variable keys: {', '.join(variables.keys())}")
     
-    return variables, None
\ No newline at end of file
+    return variables, None
+
+def fetch_template_variables_bulk(usns):
+    """
+    Fetches template variables for many USNs with a single joined query.
+    Returns a dict of USN -> variables and a dict of USN -> error message.
+    """
+    usns = list(usns)
+    logger.debug(f"Fetching template variables for {len(usns)} USNs")
+
+    resolved = {}
+    for start in range(0, len(usns), BULK_LOOKUP_CHUNK):
+        chunk = usns[start:start + BULK_LOOKUP_CHUNK]
+        rows = (
+            GroupMember.query
+            .join(Group, Group.group_id == GroupMember.group_id)
+            .add_columns(Group.name, Group.description)
+            .filter(GroupMember.usn.in_(chunk))
+            .all()
+        )
+        for member, group_name, group_description in rows:
+            if member.usn in resolved:
+                continue
+            variables = member.__dict__.copy()
+            variables.pop('_sa_instance_state', None)
+            variables["class_name"] = group_name
+            variables["class_description"] = group_description
+            resolved[member.usn] = variables
+
+    errors = {usn: f"USN '{usn}' not found" for usn in usns if usn not in resolved}
+    if errors:
+        logger.warning(f"{len(errors)} USN(s) not found while fetching template variables")
+
+    logger.info(f"Resolved template variables for {len(resolved)} of {len(usns)} USNs")
+    return resolved, errors
@@ -0,0 +1,28 @@
+# wsgi.py
+# Production entry point for multi-worker servers, e.g.:
+#   gunicorn -w 4 -k gthread --threads 8 --timeout 900 --graceful-timeout 900 -b 0.0.0.0:10000 wsgi:app
+# /api/send_email sends synchronously and large sends take minutes, so don't use
+# the default sync worker and 30s timeout: a killed worker takes its scheduler
+# with it, and a scheduled email it had claimed is not retried (at-most-once).
+# gthread workers keep heartbeating while a request thread sends; keep
+# --timeout/--graceful-timeout above the longest expected send so restarts
+# let in-flight sends finish.
+# Don't use --preload: the scheduler threads must start inside each worker.
+# Run `python -m utils.migrate` once per deploy first to build indexes.
+# Every worker runs a scheduler, but only the holder of the database lease
+# (see utils/leader.py) sends scheduled mail, so workers and nodes can scale freely.
+from app import app
+from models import db
+from scheduler import start_scheduler
+from utils.logger import logger
+
+with app.app_context():
+    try:
+        db.create_all()
+    except Exception as e:
+        # Another worker may be creating the same tables concurrently
+        logger.warning(f"Skipping table creation in worker: {e}")
+        db.session.rollback()
+
+    logger.info("Starting scheduler in worker")
+    start_scheduler(app)